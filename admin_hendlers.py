@@ -3,15 +3,29 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, update, func, desc, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-import random
-import string
+from html import escape
 
 from database import User, Movie, Channel, Rating, Stats, Broadcast, get_db
 from admin_keyboard import *
 from config import Config
+from cache import subscription_cache, user_cache, inline_query_cache, UserSnapshot
+from catalog import movie_catalog, code_allocator
+from middlewares import pipeline_timings
+from writer import write_queue
+from storage import fsm_storage
+from markups import markup_cache
+from rollups import get_rollup, ROLLUP_WINDOWS
+from search import search_movies
+from user_keyboard import movie_search_results
+from leaderboard import movie_leaderboard, user_leaderboard, seed_movie_leaderboard, ensure_exact
+from broadcast import (
+    create_broadcast_job, start_broadcast, set_broadcast_status, broadcast_progress_text,
+    count_recipients, segment_label
+)
+from workers import invalidate_user, catalog_changed
 
 router = Router()
 
@@ -27,6 +41,8 @@ class AdminStates(StatesGroup):
     waiting_delete_channel = State()
     waiting_channel_delete = State()
     waiting_broadcast = State()
+    waiting_broadcast_movie = State()
+    waiting_movie_search = State()
 
 
 class ChannelStates(StatesGroup):
@@ -34,20 +50,22 @@ class ChannelStates(StatesGroup):
     waiting_delete_channel = State()
 
 
-# Code generator
-def generate_code() -> str:
-    return ''.join(random.choices(string.digits, k=4))
-
 # Check if user is admin
 async def is_admin(user_id: int, db: AsyncSession) -> bool:
     # 1) .env dagi adminlar
     if user_id in Config.ADMIN_IDS:
         return True
 
-    # 2) Bazadagi adminlar
-    result = await db.execute(select(User).where(User.tg_id == user_id))
-    user = result.scalar_one_or_none()
-    return user and user.is_admin
+    # 2) Bazadagi adminlar (odatda UserContextMiddleware keshidan)
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        result = await db.execute(select(User).where(User.tg_id == user_id))
+        user = result.scalar_one_or_none()
+        if not user:
+            return False
+        snapshot = UserSnapshot(user)
+        user_cache.set(snapshot)
+    return snapshot.is_admin
 
 
 # Admin main menu
@@ -74,11 +92,13 @@ async def movie_management(message: Message, db: AsyncSession):
     
     result = await db.execute(select(func.count(Movie.id)))
     total_movies = result.scalar()
+    codes = code_allocator.stats()
     
     text = f"""
 🎬 <b>KINO BOSHQARUVI</b>
 
 📊 Jami kinolar: {total_movies} ta
+🔢 Band kodlar: {codes['used']} / {codes['size']} ({codes['fill_percent']}%)
 
 Quyidagi amallardan birini tanlang:
     """
@@ -173,18 +193,21 @@ Yoki "yuq" yozing tavsif bermaslik uchun.
     await state.set_state(AdminStates.waiting_movie_desc)
 
 
-@router.message(AdminStates.waiting_movie_desc, F.text)
+@router.message(AdminStates.waiting_movie_desc, F.text, flags={"db": "write"})
 async def add_movie_desc(message: Message, state: FSMContext, db: AsyncSession):
     description = None if message.text.lower() in ['yuq', 'yo\'q', 'no'] else message.text
     
     data = await state.get_data()
     
-    # Generate unique code
-    while True:
-        code = generate_code()
-        result = await db.execute(select(Movie).where(Movie.code == code))
-        if not result.scalar_one_or_none():
-            break
+    # Reserve unique code
+    if not code_allocator.loaded:
+        await code_allocator.load(db)
+    
+    try:
+        code = code_allocator.allocate()
+    except ValueError:
+        await message.answer("❌ Bo'sh kod qolmadi! Eski kinolarni o'chiring.")
+        return
     
     # Create movie
     movie = Movie(
@@ -195,9 +218,16 @@ async def add_movie_desc(message: Message, state: FSMContext, db: AsyncSession):
         created_by=message.from_user.id
     )
     
-    db.add(movie)
-    await db.commit()
+    try:
+        db.add(movie)
+        await db.commit()
+    except Exception:
+        code_allocator.release(code)
+        raise
     await db.refresh(movie)
+    movie_catalog.add(movie)
+    movie_leaderboard.offer(movie.id, 0)
+    catalog_changed()
     
     text = f"""
 ✅ <b>KINO MUVAFFAQIYATLI QO'SHILDI!</b>
@@ -262,7 +292,7 @@ async def delete_movie_confirm(message: Message, state: FSMContext, db: AsyncSes
 
 
 # 3️⃣ — Final delete
-@router.callback_query(F.data.startswith("confirm_delete_movie_"))
+@router.callback_query(F.data.startswith("confirm_delete_movie_"), flags={"db": "write"})
 async def delete_movie_final(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     movie_id = int(callback.data.split("_")[-1])
 
@@ -272,6 +302,10 @@ async def delete_movie_final(callback: CallbackQuery, state: FSMContext, db: Asy
     if movie:
         await db.delete(movie)
         await db.commit()
+        movie_catalog.remove(movie.id)
+        movie_leaderboard.remove(movie.id)
+        code_allocator.release(movie.code)
+        catalog_changed()
 
         await callback.message.edit_text(
             f"✅ Kino '{movie.title}' muvaffaqiyatli o'chirildi!",
@@ -284,28 +318,133 @@ async def delete_movie_final(callback: CallbackQuery, state: FSMContext, db: Asy
     await callback.answer()
 
 
-# List movies
-@router.callback_query(F.data.startswith("list_movies"))
+# Search movies (full-text)
+@router.callback_query(F.data == "search_movie")
+async def search_movie_start(callback: CallbackQuery, state: FSMContext):
+    text = """
+🔍 <b>KINO QIDIRISH</b>
+
+Kino nomi yoki tavsifidan so'z kiriting:
+
+Misol: avatar
+
+❌ Bekor qilish: /cancel
+    """
+    
+    await callback.message.answer(text, reply_markup=cancel_button(), parse_mode="HTML")
+    await state.set_state(AdminStates.waiting_movie_search)
+    await callback.answer()
+
+
+async def movie_search_page(db: AsyncSession, query: str, page: int):
+    """Text and keyboard of one results page"""
+    movies, has_next = await search_movies(db, query, page, Config.MOVIES_PER_PAGE)
+    
+    if not movies:
+        return f"📭 \"{escape(query)}\" bo'yicha kino topilmadi!", back_button("movie_management")
+    
+    text = f"🔍 <b>QIDIRUV:</b> {escape(query)} (Sahifa {page})\n\n"
+    for movie in movies:
+        text += f"🔢 <code>{movie['code']}</code> - {escape(movie['title'])}\n"
+        text += f"   👁 {movie['views']}\n\n"
+    
+    return text, movie_search_results(movies, page, has_next, back="movie_management")
+
+
+@router.message(AdminStates.waiting_movie_search)
+async def search_movie_query(message: Message, state: FSMContext, db: AsyncSession):
+    query = (message.text or "").strip()
+    
+    if not query:
+        await message.answer("❌ So'z kiriting!")
+        return
+    
+    # Query kept for page buttons, state left so menus work again
+    await state.set_state(None)
+    await state.update_data(movie_search_query=query)
+    
+    text, keyboard = await movie_search_page(db, query, 1)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("msearch_page_"))
+async def search_movie_page(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
+    query = (await state.get_data()).get('movie_search_query')
+    
+    if not query:
+        await callback.answer("❌ Qidiruv eskirgan, qaytadan qidiring!", show_alert=True)
+        return
+    
+    page = int(callback.data.split("_")[-1])
+    text, keyboard = await movie_search_page(db, query, page)
+    
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
+# Search result -> movie card
+@router.callback_query(F.data.startswith("get_movie_"))
+async def search_movie_open(callback: CallbackQuery, db: AsyncSession):
+    if not await is_admin(callback.from_user.id, db):
+        return
+    
+    movie = movie_catalog.get(callback.data.split("_")[-1])
+    
+    if not movie:
+        await callback.answer("❌ Kino topilmadi!", show_alert=True)
+        return
+    
+    text = f"""
+🎬 <b>{escape(movie.title)}</b>
+
+🔢 Kod: <code>{movie.code}</code>
+👁 Ko'rilgan: {movie.views} marta
+⭐️ Rating: {movie.likes} 👍 / {movie.dislikes} 👎
+    """
+    
+    await callback.message.answer(text, reply_markup=delete_movie_confirm_btn(movie.id), parse_mode="HTML")
+    await callback.answer()
+
+
+# Movie list cursor: created_at + id of a page edge
+def encode_movie_cursor(movie: Movie) -> str:
+    return f"{movie.created_at.strftime('%Y%m%d%H%M%S%f')}_{movie.id}"
+
+
+def decode_movie_cursor(created_at: str, movie_id: str) -> tuple:
+    return datetime.strptime(created_at, '%Y%m%d%H%M%S%f'), int(movie_id)
+
+
+# List movies (keyset pagination, same cost on every page)
+@router.callback_query((F.data == "list_movies") | F.data.regexp(r'^movies_(next|prev)_\d+_\d+_\d+$'))
 async def list_movies(callback: CallbackQuery, db: AsyncSession):
+    per_page = Config.MOVIES_PER_PAGE
     page = 1
-    if "_page_" in callback.data:
-        page = int(callback.data.split("_")[-1])
+    direction = "next"
     
-    per_page = 10
-    offset = (page - 1) * per_page
+    query = select(Movie).where(Movie.is_active == True)
+    position = tuple_(Movie.created_at, Movie.id)
     
-    result = await db.execute(
-        select(Movie)
-        .where(Movie.is_active == True)
-        .order_by(desc(Movie.created_at))
-        .limit(per_page)
-        .offset(offset)
-    )
+    if callback.data != "list_movies":
+        _, direction, page, created_at, movie_id = callback.data.split("_")
+        page = int(page)
+        cursor = decode_movie_cursor(created_at, movie_id)
+        query = query.where(position < cursor if direction == "next" else position > cursor)
+    
+    if direction == "next":
+        query = query.order_by(desc(Movie.created_at), desc(Movie.id))
+    else:
+        query = query.order_by(Movie.created_at, Movie.id)
+    
+    result = await db.execute(query.limit(per_page))
     movies = result.scalars().all()
+    if direction == "prev":
+        movies = movies[::-1]
     
-    count_result = await db.execute(select(func.count(Movie.id)).where(Movie.is_active == True))
-    total = count_result.scalar()
-    total_pages = (total + per_page - 1) // per_page
+    # Active movies are all in the catalog, no count query
+    total = len(movie_catalog)
+    total_pages = max((total + per_page - 1) // per_page, 1)
+    page = min(page, total_pages)
     
     if not movies:
         await callback.message.edit_text("📭 Kinolar topilmadi!", reply_markup=back_button())
@@ -319,11 +458,21 @@ async def list_movies(callback: CallbackQuery, db: AsyncSession):
     
     await callback.message.edit_text(
         text,
-        reply_markup=movie_list_pagination(page, total_pages),
+        reply_markup=movie_list_pagination(
+            page,
+            total_pages,
+            first_cursor=encode_movie_cursor(movies[0]),
+            last_cursor=encode_movie_cursor(movies[-1])
+        ),
         parse_mode="HTML"
     )
     await callback.answer()
 
+
+@router.callback_query(F.data == "current_page")
+async def current_page(callback: CallbackQuery):
+    await callback.answer()
+
 # CONTINUATION OF admin_handlers.py
 
 # Channel management
@@ -346,7 +495,7 @@ async def add_channel_start(callback: CallbackQuery, state: FSMContext):
     await state.set_state(ChannelStates.waiting_channel_username)
     await callback.answer()
 
-@router.message(ChannelStates.waiting_channel_username)
+@router.message(ChannelStates.waiting_channel_username, flags={"db": "write"})
 async def add_channel_finish(message: Message, state: FSMContext, bot: Bot, db: AsyncSession):
     username = message.text.strip()
 
@@ -411,7 +560,7 @@ async def delete_channel_confirm_step(message: Message, state: FSMContext, db: A
         parse_mode="HTML"
     )
 
-@router.callback_query(F.data.startswith("confirm_delete_channel_"))
+@router.callback_query(F.data.startswith("confirm_delete_channel_"), flags={"db": "write"})
 async def delete_channel_final(callback: CallbackQuery, db: AsyncSession, state: FSMContext):
     channel_id = int(callback.data.split("_")[-1])
 
@@ -434,7 +583,7 @@ async def delete_channel_final(callback: CallbackQuery, db: AsyncSession, state:
 
 
 
-@router.callback_query(F.data.startswith("confirm_delete_channel_"))
+@router.callback_query(F.data.startswith("confirm_delete_channel_"), flags={"db": "write"})
 async def delete_channel_final(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
     channel_id = int(callback.data.split("_")[-1])
 
@@ -508,58 +657,139 @@ Qaysi davr statistikasini ko'rmoqchisiz?
 async def show_statistics(callback: CallbackQuery, db: AsyncSession):
     stats_type = callback.data.split("_")[1]
     
-    # Get counts
-    users_result = await db.execute(select(func.count(User.id)))
-    total_users = users_result.scalar()
-    
-    movies_result = await db.execute(select(func.count(Movie.id)))
-    total_movies = movies_result.scalar()
-    
-    views_result = await db.execute(select(func.sum(Movie.views)))
-    total_views = views_result.scalar() or 0
-    
-    ratings_result = await db.execute(select(func.count(Rating.id)))
-    total_ratings = ratings_result.scalar()
-    
-    # Time-based stats
-    if stats_type == "daily":
-        period = datetime.now() - timedelta(days=1)
-        period_name = "Bugun"
-    elif stats_type == "weekly":
-        period = datetime.now() - timedelta(days=7)
-        period_name = "Bu hafta"
-    elif stats_type == "monthly":
-        period = datetime.now() - timedelta(days=30)
-        period_name = "Bu oy"
-    else:
-        period = None
-        period_name = "Umumiy"
+    # Precomputed rollup (rollups.StatsRollup), one indexed read
+    period_names = {"daily": "Bugun", "weekly": "Bu hafta", "monthly": "Bu oy"}
+    period_name = period_names.get(stats_type, "Umumiy")
     
-    if period:
-        new_users_result = await db.execute(
-            select(func.count(User.id)).where(User.joined_at >= period)
-        )
-        new_users = new_users_result.scalar()
+    stats = await get_rollup(db, stats_type if stats_type in ROLLUP_WINDOWS else "daily")
+    if stats is None:
+        await callback.answer("❌ Statistika hali tayyor emas!", show_alert=True)
+        return
+    
+    if stats_type in ROLLUP_WINDOWS:
+        new_users = stats.new_users
+        new_movies = stats.new_movies
+        new_ratings = stats.new_ratings
     else:
-        new_users = total_users
+        new_users = stats.total_users
+        new_movies = stats.total_movies
+        new_ratings = stats.total_ratings
     
     text = f"""
 📊 <b>STATISTIKA - {period_name.upper()}</b>
 
-👥 Foydalanuvchilar: {total_users} ta
+👥 Foydalanuvchilar: {stats.total_users} ta
    └ Yangi: {new_users} ta
+   └ Faol: {stats.active_users} ta
+   └ Botni bloklagan: {stats.unreachable_users} ta
 
-🎬 Kinolar: {total_movies} ta
-👁 Ko'rilgan: {total_views} marta
-⭐️ Baholanganlar: {total_ratings} ta
+🎬 Kinolar: {stats.total_movies} ta
+   └ Yangi: {new_movies} ta
+👁 Ko'rilgan: {stats.total_views} marta
+⭐️ Baholanganlar: {stats.total_ratings} ta
+   └ Yangi: {new_ratings} ta
 
 📅 Sana: {datetime.now().strftime('%d.%m.%Y %H:%M')}
+🔄 Yangilangan: {stats.updated_at.strftime('%H:%M')} (UTC)
     """
     
     await callback.message.edit_text(text, reply_markup=back_button(), parse_mode="HTML")
     await callback.answer()
 
 
+# Cache statistics
+@router.message(Command("cache"))
+async def cache_statistics(message: Message, db: AsyncSession):
+    if not await is_admin(message.from_user.id, db):
+        return
+    
+    stats = subscription_cache.stats()
+    users = user_cache.stats()
+    inline = inline_query_cache.stats()
+    fsm = fsm_storage.stats()
+    keyboards = markup_cache.stats()
+    
+    text = f"""
+🗂 <b>OBUNA KESHI</b>
+
+📦 Hajmi: {stats['size']} / {stats['max_size']}
+✅ Hit: {stats['hits']}
+❌ Miss: {stats['misses']}
+🎯 Hit rate: {stats['hit_rate']}%
+🧹 Chiqarilgan: {stats['evictions']}
+
+⏱ TTL: {subscription_cache.positive_ttl}s (+) / {subscription_cache.negative_ttl}s (-)
+
+👥 <b>FOYDALANUVCHI KESHI</b>
+
+📦 Hajmi: {users['size']} / {users['max_size']}
+🎯 Hit rate: {users['hit_rate']}% ({users['hits']} / {users['misses']})
+
+🔎 <b>INLINE QIDIRUV KESHI</b>
+
+📦 Hajmi: {inline['size']} / {inline['max_size']}
+🎯 Hit rate: {inline['hit_rate']}% ({inline['hits']} / {inline['misses']})
+
+💬 <b>FSM KESHI</b>
+
+📦 Hajmi: {fsm['size']} / {fsm['max_size']}
+🎯 Hit rate: {fsm['hit_rate']}% ({fsm['hits']} / {fsm['misses']})
+
+⌨️ <b>KLAVIATURALAR</b>
+
+📌 Doimiy: {keyboards['static']} ta
+📦 Keshda: {keyboards['size']} / {keyboards['max_size']}
+🎯 Hit rate: {keyboards['hit_rate']}% ({keyboards['hits']} / {keyboards['misses']})
+    """
+    
+    await message.answer(text, parse_mode="HTML")
+
+
+# Middleware pipeline timings
+@router.message(Command("pipeline"))
+async def pipeline_statistics(message: Message, db: AsyncSession):
+    if not await is_admin(message.from_user.id, db):
+        return
+    
+    text = "⏱ <b>PIPELINE VAQTLARI</b>\n\n"
+    for stage, stats in pipeline_timings.stats().items():
+        text += f"<b>{stage}</b>: {stats['count']} ta | o'rtacha {stats['avg_ms']} ms | max {stats['max_ms']} ms\n"
+    
+    writes = write_queue.stats()
+    text += f"""
+✍️ <b>Yozish navbati</b>
+├ Navbatda: {writes['queued']} ta
+├ Yozilgan: {writes['operations']} ta ({writes['commits']} commit)
+├ Commit boshiga: {writes['per_commit']} ta
+└ Xato: {writes['failed']} ta
+"""
+    
+    await message.answer(text, parse_mode="HTML")
+
+
+# Rebuild movie catalog index
+@router.message(Command("reindex"))
+async def rebuild_catalog(message: Message, db: AsyncSession):
+    if not await is_admin(message.from_user.id, db):
+        return
+    
+    count = await movie_catalog.load(db)
+    await code_allocator.load(db)
+    seed_movie_leaderboard()
+    catalog_changed()
+    codes = code_allocator.stats()
+    
+    text = f"""
+🗂 <b>KINO INDEKSI YANGILANDI</b>
+
+🎬 Faol kinolar: {count} ta
+🔢 Band kodlar: {codes['used']} / {codes['size']} ({codes['fill_percent']}%)
+💾 Xotira: {movie_catalog.memory_usage() / 1024:.1f} KB
+    """
+    
+    await message.answer(text, parse_mode="HTML")
+
+
 # Super statistics
 @router.message(F.text == "🔝 Super statistika")
 async def super_statistics(message: Message, db: AsyncSession):
@@ -576,22 +806,22 @@ Qaysi ma'lumotni ko'rmoqchisiz?
 
 
 @router.callback_query(F.data == "top_movies")
-async def top_movies(callback: CallbackQuery, db: AsyncSession):
-    result = await db.execute(
-        select(Movie)
-        .where(Movie.is_active == True)
-        .order_by(desc(Movie.views))
-        .limit(10)
-    )
-    movies = result.scalars().all()
+async def top_movies(callback: CallbackQuery):
+    # In-memory leaderboard (leaderboard.py), no table sort
+    await ensure_exact()
     
     text = "🏆 <b>TOP 10 ENG KO'P KO'RILGAN KINOLAR</b>\n\n"
     
     medals = ["🥇", "🥈", "🥉"]
-    for i, movie in enumerate(movies, 1):
-        medal = medals[i-1] if i <= 3 else f"{i}."
+    place = 0
+    for movie_id, views in movie_leaderboard.top():
+        movie = movie_catalog.get_by_id(movie_id)
+        if not movie:
+            continue
+        place += 1
+        medal = medals[place-1] if place <= 3 else f"{place}."
         text += f"{medal} {movie.title}\n"
-        text += f"   👁 {movie.views} | ⭐️ {movie.likes}👍 {movie.dislikes}👎\n\n"
+        text += f"   👁 {views} | ⭐️ {movie.likes}👍 {movie.dislikes}👎\n\n"
     
     await callback.message.edit_text(text, reply_markup=back_button(), parse_mode="HTML")
     await callback.answer()
@@ -599,27 +829,56 @@ async def top_movies(callback: CallbackQuery, db: AsyncSession):
 
 @router.callback_query(F.data == "top_users")
 async def top_users(callback: CallbackQuery, db: AsyncSession):
-    result = await db.execute(
-        select(User)
-        .where(User.is_blocked == False)
-        .order_by(desc(User.watched_movies))
-        .limit(10)
-    )
-    users = result.scalars().all()
+    await ensure_exact()
+    leaders = user_leaderboard.top()
+    
+    # Only the K leaders are read, by primary key
+    result = await db.execute(select(User).where(User.id.in_([user_id for user_id, _ in leaders])))
+    users = {user.id: user for user in result.scalars().all()}
     
     text = "👥 <b>TOP 10 ENG FAOL FOYDALANUVCHILAR</b>\n\n"
     
     medals = ["🥇", "🥈", "🥉"]
-    for i, user in enumerate(users, 1):
-        medal = medals[i-1] if i <= 3 else f"{i}."
+    place = 0
+    for user_id, watched in leaders:
+        user = users.get(user_id)
+        if not user:
+            continue
+        place += 1
+        medal = medals[place-1] if place <= 3 else f"{place}."
         name = user.first_name or "Unknown"
         text += f"{medal} {name}\n"
-        text += f"   🎬 Ko'rgan: {user.watched_movies} | ⭐️ Baholagan: {user.total_ratings}\n\n"
+        text += f"   🎬 Ko'rgan: {watched} | ⭐️ Baholagan: {user.total_ratings}\n\n"
     
     await callback.message.edit_text(text, reply_markup=back_button(), parse_mode="HTML")
     await callback.answer()
 
 
+# Block / unblock user
+@router.callback_query(F.data.startswith("block_user_") | F.data.startswith("unblock_user_"), flags={"db": "write"})
+async def toggle_user_block(callback: CallbackQuery, db: AsyncSession):
+    if not await is_admin(callback.from_user.id, db):
+        return
+    
+    tg_id = int(callback.data.split("_")[-1])
+    blocked = callback.data.startswith("block_user_")
+    
+    await db.execute(update(User).where(User.tg_id == tg_id).values(is_blocked=blocked))
+    await db.commit()
+    invalidate_user(tg_id)
+    
+    # Top users only lists non-blocked users
+    result = await db.execute(select(User.id, User.watched_movies).where(User.tg_id == tg_id))
+    row = result.first()
+    if row and blocked:
+        user_leaderboard.remove(row.id)
+    elif row and row.watched_movies:
+        user_leaderboard.offer(row.id, row.watched_movies)
+    
+    text = "🚫 Foydalanuvchi bloklandi!" if blocked else "✅ Foydalanuvchi blokdan chiqarildi!"
+    await callback.answer(text, show_alert=True)
+
+
 # Broadcast message
 @router.message(F.text == "📨 Xabar yuborish")
 async def broadcast_start(message: Message, state: FSMContext, db: AsyncSession):
@@ -640,79 +899,164 @@ Barcha foydalanuvchilarga yubormoqchi bo'lgan xabaringizni yozing:
     await state.set_state(AdminStates.waiting_broadcast)
 
 
-@router.message(AdminStates.waiting_broadcast)
-async def broadcast_confirm(message: Message, state: FSMContext, db: AsyncSession):
-    # Get total users
-    result = await db.execute(select(func.count(User.id)).where(User.is_blocked == False))
-    total = result.scalar()
-    
-    await state.update_data(broadcast_message=message.message_id, broadcast_chat=message.chat.id)
-    
-    text = f"""
+def broadcast_audience_text(segment: str, total: int) -> str:
+    return f"""
 ✅ Xabar qabul qilindi!
 
+🎯 Auditoriya: {segment_label(segment)}
 👥 Jo'natiladi: {total} ta foydalanuvchiga
 
-Xabarni yuborishni tasdiqlaysizmi?
+Auditoriyani tanlang yoki yuborishni tasdiqlang:
     """
+
+
+def broadcast_created_at(data: dict) -> datetime:
+    """Moment the broadcast was composed (counts and the job use it)"""
+    value = data.get('broadcast_created_at')
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+@router.message(AdminStates.waiting_broadcast)
+async def broadcast_confirm(message: Message, state: FSMContext, db: AsyncSession):
+    # Day windows of the count and of the job start from the same moment
+    created_at = datetime.utcnow()
+    
+    # Exact audience size (all reachable users by default)
+    total = await count_recipients(db, "all", created_at)
     
-    await message.answer(text, reply_markup=broadcast_menu(), parse_mode="HTML")
+    await state.update_data(
+        broadcast_message=message.message_id,
+        broadcast_chat=message.chat.id,
+        broadcast_segment="all",
+        broadcast_created_at=created_at.isoformat()
+    )
+    
+    await message.answer(broadcast_audience_text("all", total), reply_markup=broadcast_menu(), parse_mode="HTML")
 
 
-@router.callback_query(F.data == "broadcast_confirm")
-async def broadcast_send(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
+# Audience segment selection
+@router.callback_query(F.data.startswith("bc_seg_"))
+async def broadcast_segment(callback: CallbackQuery, state: FSMContext, db: AsyncSession):
+    if not await is_admin(callback.from_user.id, db):
+        return
+    
     data = await state.get_data()
+    if 'broadcast_message' not in data:
+        await callback.answer("❌ Xabar topilmadi, qaytadan boshlang!", show_alert=True)
+        return
     
-    # Get all users
-    result = await db.execute(select(User).where(User.is_blocked == False))
-    users = result.scalars().all()
+    segment = callback.data[len("bc_seg_"):]
     
-    sent = 0
-    failed = 0
+    if segment == "rated":
+        await state.set_state(AdminStates.waiting_broadcast_movie)
+        await callback.message.answer(
+            "⭐️ Qaysi kinoni baholaganlarga yuborilsin? Kino kodini kiriting:",
+            reply_markup=cancel_button()
+        )
+        await callback.answer()
+        return
     
-    progress_msg = await callback.message.answer("📤 Xabar yuborilmoqda... 0%")
+    try:
+        total = await count_recipients(db, segment, broadcast_created_at(data))
+    except ValueError:
+        await callback.answer("❌ Noto'g'ri auditoriya!", show_alert=True)
+        return
     
-    total = len(users)
-    for i, user in enumerate(users, 1):
-        try:
-            await callback.bot.copy_message(
-                chat_id=user.tg_id,
-                from_chat_id=data['broadcast_chat'],
-                message_id=data['broadcast_message']
-            )
-            sent += 1
-        except Exception:
-            failed += 1
-        
-        # Update progress every 10%
-        if i % max(1, total // 10) == 0:
-            percent = int((i / total) * 100)
-            await progress_msg.edit_text(f"📤 Xabar yuborilmoqda... {percent}%")
-    
-    # Save broadcast stats
-    broadcast = Broadcast(
-        message_text="Broadcast message",
-        sent_count=sent,
-        failed_count=failed,
-        created_by=callback.from_user.id,
-        completed_at=datetime.now()
+    await state.update_data(broadcast_segment=segment)
+    await callback.message.edit_text(
+        broadcast_audience_text(segment, total),
+        reply_markup=broadcast_menu(segment),
+        parse_mode="HTML"
     )
-    db.add(broadcast)
-    await db.commit()
+    await callback.answer()
+
+
+@router.message(AdminStates.waiting_broadcast_movie)
+async def broadcast_segment_movie(message: Message, state: FSMContext, db: AsyncSession):
+    movie = movie_catalog.get((message.text or "").strip())
     
-    text = f"""
-✅ <b>XABAR YUBORILDI!</b>
+    if not movie:
+        await message.answer("❌ Bu kod bilan kino topilmadi! Qaytadan kiriting:")
+        return
+    
+    segment = f"rated:{movie.id}"
+    total = await count_recipients(db, segment, broadcast_created_at(await state.get_data()))
+    
+    await state.update_data(broadcast_segment=segment)
+    await state.set_state(AdminStates.waiting_broadcast)
+    
+    await message.answer(broadcast_audience_text(segment, total), reply_markup=broadcast_menu(segment), parse_mode="HTML")
 
-✅ Muvaffaqiyatli: {sent} ta
-❌ Xato: {failed} ta
-📊 Jami: {total} ta
-    """
+
+@router.callback_query(F.data == "broadcast_confirm")
+async def broadcast_send(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    
+    progress_msg = await callback.message.answer("📤 Xabar yuborilmoqda... 0%")
+    
+    # Persisted as a job, runs in background and survives restarts
+    job_id = await create_broadcast_job(
+        from_chat_id=data['broadcast_chat'],
+        message_id=data['broadcast_message'],
+        created_by=callback.from_user.id,
+        progress_chat_id=progress_msg.chat.id,
+        progress_message_id=progress_msg.message_id,
+        segment=data.get('broadcast_segment', "all"),
+        created_at=broadcast_created_at(data)
+    )
+    start_broadcast(callback.bot, job_id)
+    await progress_msg.edit_reply_markup(reply_markup=broadcast_job_controls(job_id, "running"))
     
-    await progress_msg.edit_text(text, parse_mode="HTML")
     await state.clear()
     await callback.answer()
 
 
+# Broadcast job controls (pause / resume / cancel)
+@router.callback_query(F.data.regexp(r'^bc_(pause|resume|cancel)_\d+$'))
+async def broadcast_control(callback: CallbackQuery, db: AsyncSession):
+    if not await is_admin(callback.from_user.id, db):
+        return
+    
+    _, action, job_id = callback.data.split("_")
+    status = {"pause": "paused", "resume": "running", "cancel": "cancelled"}[action]
+    
+    if not await set_broadcast_status(callback.bot, int(job_id), status):
+        await callback.answer("❌ Bu amalni bajarib bo'lmaydi!", show_alert=True)
+        return
+    
+    texts = {
+        "paused": "⏸ Joriy qism tugagach to'xtatiladi",
+        "running": "▶️ Davom ettirilmoqda",
+        "cancelled": "🛑 Bekor qilindi"
+    }
+    await callback.answer(texts[status], show_alert=True)
+
+
+# Unfinished broadcast jobs
+@router.message(Command("broadcasts"))
+async def broadcast_jobs(message: Message, db: AsyncSession):
+    if not await is_admin(message.from_user.id, db):
+        return
+    
+    result = await db.execute(
+        select(Broadcast)
+        .where(Broadcast.status.in_(["running", "paused"]))
+        .order_by(desc(Broadcast.id))
+    )
+    jobs = result.scalars().all()
+    
+    if not jobs:
+        await message.answer("📭 Faol xabar yuborishlar yo'q!")
+        return
+    
+    for job in jobs:
+        await message.answer(
+            broadcast_progress_text(job),
+            reply_markup=broadcast_job_controls(job.id, job.status),
+            parse_mode="HTML"
+        )
+
+
 # Cancel operation
 @router.message(Command("cancel"), StateFilter("*"))
 @router.callback_query(F.data == "cancel", StateFilter("*"))
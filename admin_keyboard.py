@@ -1,7 +1,10 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
+from markups import prebuilt, cached
+
 
 # Admin main menu
+@prebuilt
 def admin_main_menu() -> ReplyKeyboardMarkup:
     keyboard = [
         [KeyboardButton(text="🎬 Kino boshqaruvi"), KeyboardButton(text="📢 Kanal boshqaruvi")],
@@ -11,6 +14,7 @@ def admin_main_menu() -> ReplyKeyboardMarkup:
     ]
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
 
+@cached
 def delete_movie_confirm_btn(movie_id: int):
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -27,6 +31,7 @@ def delete_movie_confirm_btn(movie_id: int):
     )
 
 # Movie management
+@prebuilt
 def movie_management_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="➕ Kino qo'shish", callback_data="add_movie")],
@@ -38,6 +43,7 @@ def movie_management_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+@prebuilt
 def channel_management_menu():
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="➕ Kanal qo‘shish", callback_data="add_channel")],
@@ -49,6 +55,7 @@ def channel_management_menu():
     return kb
 
 
+@cached
 def channel_delete_confirm(channel_id: int):
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🗑 Ha, o‘chirish", callback_data=f"confirm_delete_channel_{channel_id}")],
@@ -57,6 +64,7 @@ def channel_delete_confirm(channel_id: int):
     return kb
 
 
+@cached
 def force_switch(channel_id: int, is_active: bool):
     text = "❌ O‘chirish" if is_active else "✅ Yoqish"
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -64,6 +72,7 @@ def force_switch(channel_id: int, is_active: bool):
         [InlineKeyboardButton(text="⬅️ Orqaga", callback_data="force_channels")]
     ])
 
+@cached
 def confirm_delete_channel_btn(channel_id: int):
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -79,6 +88,7 @@ def confirm_delete_channel_btn(channel_id: int):
 
 
 # Channel type selection
+@prebuilt
 def channel_type_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="📺 Asosiy kanal", callback_data="channel_type_main")],
@@ -90,6 +100,7 @@ def channel_type_menu() -> InlineKeyboardMarkup:
 
 
 # Statistics menu
+@prebuilt
 def statistics_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="📅 Kunlik", callback_data="stats_daily")],
@@ -102,6 +113,7 @@ def statistics_menu() -> InlineKeyboardMarkup:
 
 
 # Super statistics menu
+@prebuilt
 def super_stats_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🎬 Top kinolar", callback_data="top_movies")],
@@ -113,16 +125,58 @@ def super_stats_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+# Broadcast audience segments (segment, button text)
+BROADCAST_SEGMENTS = [
+    ("all", "👥 Hammasi"),
+    ("active:7", "🟢 7 kun faol"),
+    ("active:30", "🟢 30 kun faol"),
+    ("joined:7", "🆕 7 kunda qo'shilgan"),
+    ("joined:30", "🆕 30 kunda qo'shilgan"),
+    ("watched:5", "🎬 5+ kino ko'rgan"),
+    ("rated", "⭐️ Kinoni baholaganlar"),
+]
+
+
 # Broadcast menu
-def broadcast_menu() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton(text="✅ Yuborish", callback_data="broadcast_confirm")],
-        [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="broadcast_cancel")]
+@cached
+def broadcast_menu(segment: str = "all") -> InlineKeyboardMarkup:
+    selected = segment.partition(":")[0] if segment.startswith("rated") else segment
+    
+    buttons = [
+        InlineKeyboardButton(
+            text=f"✅ {text}" if value == selected else text,
+            callback_data=f"bc_seg_{value}"
+        )
+        for value, text in BROADCAST_SEGMENTS
     ]
+    
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    keyboard.append([InlineKeyboardButton(text="✅ Yuborish", callback_data="broadcast_confirm")])
+    keyboard.append([InlineKeyboardButton(text="❌ Bekor qilish", callback_data="broadcast_cancel")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+# Broadcast job controls
+@cached
+def broadcast_job_controls(job_id: int, status: str) -> InlineKeyboardMarkup:
+    keyboard = []
+    
+    if status == "running":
+        keyboard.append([
+            InlineKeyboardButton(text="⏸ To'xtatish", callback_data=f"bc_pause_{job_id}"),
+            InlineKeyboardButton(text="🛑 Bekor qilish", callback_data=f"bc_cancel_{job_id}")
+        ])
+    elif status == "paused":
+        keyboard.append([
+            InlineKeyboardButton(text="▶️ Davom ettirish", callback_data=f"bc_resume_{job_id}"),
+            InlineKeyboardButton(text="🛑 Bekor qilish", callback_data=f"bc_cancel_{job_id}")
+        ])
+    
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
 # Movie delete confirmation
+@cached
 def delete_movie_confirm(movie_id: int) -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="✅ Ha, o'chirish", callback_data=f"confirm_delete_movie_{movie_id}")],
@@ -132,6 +186,7 @@ def delete_movie_confirm(movie_id: int) -> InlineKeyboardMarkup:
 
 
 # Channel delete confirmation
+@cached
 def delete_channel_confirm(channel_id: int) -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="✅ Ha, o'chirish", callback_data=f"confirm_delete_channel_{channel_id}")],
@@ -140,18 +195,18 @@ def delete_channel_confirm(channel_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
-# Movie list pagination
-def movie_list_pagination(page: int, total_pages: int) -> InlineKeyboardMarkup:
+# Movie list pagination (cursors: "<created_at>_<id>" of the page edges)
+def movie_list_pagination(page: int, total_pages: int, first_cursor: str = None, last_cursor: str = None) -> InlineKeyboardMarkup:
     keyboard = []
     
     nav_buttons = []
-    if page > 1:
-        nav_buttons.append(InlineKeyboardButton(text="◀️ Oldingi", callback_data=f"movies_page_{page-1}"))
+    if page > 1 and first_cursor:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Oldingi", callback_data=f"movies_prev_{page-1}_{first_cursor}"))
     
     nav_buttons.append(InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="current_page"))
     
-    if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton(text="Keyingi ▶️", callback_data=f"movies_page_{page+1}"))
+    if page < total_pages and last_cursor:
+        nav_buttons.append(InlineKeyboardButton(text="Keyingi ▶️", callback_data=f"movies_next_{page+1}_{last_cursor}"))
     
     if nav_buttons:
         keyboard.append(nav_buttons)
@@ -162,6 +217,7 @@ def movie_list_pagination(page: int, total_pages: int) -> InlineKeyboardMarkup:
 
 
 # User management
+@cached
 def user_management_menu(user_id: int) -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🚫 Bloklash", callback_data=f"block_user_{user_id}")],
@@ -173,6 +229,7 @@ def user_management_menu(user_id: int) -> InlineKeyboardMarkup:
 
 
 # Back button
+@cached
 def back_button(callback: str = "back_to_admin") -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🔙 Ortga", callback_data=callback)]
@@ -181,6 +238,7 @@ def back_button(callback: str = "back_to_admin") -> InlineKeyboardMarkup:
 
 
 # Cancel button
+@prebuilt
 def cancel_button() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="cancel")]
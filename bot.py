@@ -1,45 +1,74 @@
 import asyncio
 from datetime import datetime
 import logging
-import sys
-import os
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from database import init_db, close_db
+from database import init_db, close_db, async_session_maker
+from catalog import movie_catalog, code_allocator
+from counters import view_counter, activity_tracker
+from writer import write_queue
+from storage import fsm_storage, fsm_cleaner
+from rollups import stats_rollup
+from leaderboard import load_leaderboards, leaderboard_reconciler
+from broadcast import resume_broadcasts, stop_broadcasts
 from admin_hendlers import router as admin_router
 from user_hendlers import router as user_router
 from middlewares import setup_middlewares
+from webhook import run_webhook
+from markups import MarkupSession
+from log_pipeline import setup_logging, stop_logging
+from workers import run_sharded, catalog_refresher
 from config import Config
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-# 🔧 logs papkasini yaratish
-os.makedirs("logs", exist_ok=True)
-
-# Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
-async def on_startup(bot: Bot):
-    """Actions on bot startup"""
+async def on_startup(bot: Bot, primary: bool = True, sharded: bool = False):
+    """Actions on bot startup (primary: the process running shared jobs)"""
     logger.info("🤖 Bot starting...")
     
     # Initialize database
     await init_db()
     
+    # Load movie catalog
+    async with async_session_maker() as session:
+        count = await movie_catalog.load(session)
+        free_codes = await code_allocator.load(session)
+    logger.info(f"🎬 Movie catalog loaded: {count} movies")
+    logger.info(f"🔢 Free movie codes: {free_codes}")
+    
+    # Start single DB writer and write-behind counters
+    write_queue.start()
+    view_counter.start()
+    activity_tracker.start()
+    
+    # Top-K leaderboards
+    await load_leaderboards()
+    
+    if sharded:
+        # Movies changed in another worker show up here
+        catalog_refresher.start()
+    
+    if not primary:
+        me = await bot.get_me()
+        logger.info(f"✅ Worker started: @{me.username}")
+        return
+    
+    # Jobs that must run once: cleanup, rollups, reconciliation
+    fsm_cleaner.start()
+    stats_rollup.start()
+    leaderboard_reconciler.start()
+    
+    # Continue broadcasts interrupted by restart
+    resumed = await resume_broadcasts(bot)
+    if resumed:
+        logger.info(f"📨 Resumed broadcasts: {resumed}")
+    
     # Get bot info
     me = await bot.get_me()
     logger.info(f"✅ Bot started: @{me.username}")
@@ -60,10 +89,28 @@ async def on_startup(bot: Bot):
             logger.warning(f"Could not notify admin {admin_id}: {e}")
 
 
-async def on_shutdown(bot: Bot):
+async def on_shutdown(bot: Bot, primary: bool = True, sharded: bool = False):
     """Actions on bot shutdown"""
     logger.info("🛑 Bot stopping...")
     
+    if primary:
+        await stop_primary_jobs(bot)
+    if sharded:
+        await catalog_refresher.stop()
+    
+    # Flush pending counters
+    await view_counter.stop()
+    await activity_tracker.stop()
+    
+    # Apply queued writes
+    await write_queue.stop()
+    
+    # Close database
+    await close_db()
+    logger.info("✅ Bot stopped")
+
+
+async def stop_primary_jobs(bot: Bot):
     # Send notification to admins
     for admin_id in Config.ADMIN_IDS:
         try:
@@ -76,29 +123,26 @@ async def on_shutdown(bot: Bot):
         except Exception as e:
             logger.warning(f"Could not notify admin {admin_id}: {e}")
     
-    # Close database
-    await close_db()
-    logger.info("✅ Bot stopped")
+    # Checkpoint running broadcasts
+    await stop_broadcasts()
+    
+    # Stop rollups and cleanup
+    await stats_rollup.stop()
+    await leaderboard_reconciler.stop()
+    await fsm_cleaner.stop()
 
 
-async def main():
-    """Main bot function"""
-    from datetime import datetime
-    
-    # Validate configuration
-    try:
-        Config.validate()
-    except ValueError as e:
-        logger.error(f"❌ Configuration error: {e}")
-        return
-    
-    # Initialize bot and dispatcher
-    bot = Bot(
+def create_bot() -> Bot:
+    return Bot(
         token=Config.BOT_TOKEN,
+        session=MarkupSession(),
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    
-    dp = Dispatcher(storage=MemoryStorage())
+
+
+def create_dispatcher() -> Dispatcher:
+    # Conversation state lives in the database (survives restarts, shared by workers)
+    dp = Dispatcher(storage=fsm_storage)
     
     # Setup middlewares
     setup_middlewares(dp)
@@ -110,23 +154,50 @@ async def main():
     # Register startup/shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def main():
+    """Main bot function"""
+    # Validate configuration
+    try:
+        Config.validate()
+    except ValueError as e:
+        logger.error(f"❌ Configuration error: {e}")
+        return
+    
+    # Initialize bot and dispatcher
+    bot = create_bot()
+    dp = create_dispatcher()
     
-    # Start polling
-    logger.info("🚀 Starting polling...")
     try:
-        await dp.start_polling(
-            bot,
-            allowed_updates=dp.resolve_used_update_types(),
-            drop_pending_updates=True
-        )
+        if Config.WORKERS > 1:
+            # Receiver here, handlers in worker processes
+            await run_sharded(bot, dp.resolve_used_update_types())
+        elif Config.UPDATE_MODE == "webhook":
+            logger.info("🚀 Starting webhook...")
+            await run_webhook(bot, dp)
+        else:
+            # getUpdates fails while a webhook is set
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("🚀 Starting polling...")
+            await dp.start_polling(
+                bot,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=True
+            )
     finally:
         await bot.session.close()
 
 
 if __name__ == "__main__":
+    # Logging goes through a queue, files are written by a background thread
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("🛑 Bot stopped by user (Ctrl+C)")
     except Exception as e:
-        logger.error(f"❌ Fatal error: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"❌ Fatal error: {e}", exc_info=True)
+    finally:
+        stop_logging()
\ No newline at end of file
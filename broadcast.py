@@ -0,0 +1,423 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from sqlalchemy import select, update, func, and_
+
+from database import async_session_maker, read_session_maker, User, Rating, Broadcast
+from config import Config
+from catalog import movie_catalog
+from counters import activity_tracker, view_counter
+from writer import write_queue
+from admin_keyboard import broadcast_job_controls
+from workers import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+# Users a broadcast can be delivered to
+RECIPIENT_FILTER = and_(User.is_blocked == False, User.is_unreachable == False)
+
+def segment_filter(segment: str, now: Optional[datetime] = None):
+    """WHERE clause of an audience segment: "all" or "kind:value"
+
+    Day windows are counted back from `now` (job creation time for jobs).
+    """
+    kind, _, value = (segment or "all").partition(":")
+    if kind == "all":
+        return RECIPIENT_FILTER
+
+    value = int(value)
+    now = now or datetime.utcnow()
+
+    if kind == "active":
+        condition = User.last_active >= now - timedelta(days=value)
+    elif kind == "joined":
+        condition = User.joined_at >= now - timedelta(days=value)
+    elif kind == "watched":
+        condition = User.watched_movies >= value
+    elif kind == "rated":
+        condition = User.id.in_(select(Rating.user_id).where(Rating.movie_id == value))
+    else:
+        raise ValueError(f"Unknown segment: {segment}")
+
+    return and_(RECIPIENT_FILTER, condition)
+
+
+def segment_label(segment: str) -> str:
+    kind, _, value = (segment or "all").partition(":")
+
+    if kind == "active":
+        return f"Oxirgi {value} kunda faol"
+    if kind == "joined":
+        return f"Oxirgi {value} kunda qo'shilgan"
+    if kind == "watched":
+        return f"Kamida {value} ta kino ko'rgan"
+    if kind == "rated":
+        movie = movie_catalog.get_by_id(int(value))
+        return f"{movie.code} kodli kinoni baholagan" if movie else "Kinoni baholagan"
+    return "Barcha foydalanuvchilar"
+
+
+async def count_recipients(session, segment: str = "all", now: Optional[datetime] = None) -> int:
+    """Exact audience size of a segment (pass the job's created_at as `now`)"""
+    kind = (segment or "all").partition(":")[0]
+    # last_active / watched_movies are written in batches, store pending first
+    if kind == "active":
+        await activity_tracker.flush()
+    elif kind == "watched":
+        await view_counter.flush()
+
+    result = await session.execute(select(func.count(User.id)).where(segment_filter(segment, now)))
+    return result.scalar()
+
+
+def mark_unreachable(tg_ids: List[int], unreachable: bool = True):
+    """Flag users who blocked (or unblocked) the bot (fire and forget)"""
+    if not tg_ids:
+        return
+
+    async def write(session):
+        await session.execute(
+            update(User).where(User.tg_id.in_(list(tg_ids))).values(is_unreachable=unreachable)
+        )
+
+    write_queue.submit_nowait(write)
+
+    # Next update from these users reloads the row (and reinstates them)
+    for tg_id in tg_ids:
+        invalidate_user(tg_id)
+
+
+class TokenBucket:
+    """Async token bucket shared by all broadcast workers"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                # Flood wait from Telegram stops everyone
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop issuing tokens (RetryAfter)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class BroadcastEngine:
+    """Runs a persisted broadcast job: keyset batches, concurrent rate-limited sends
+
+    After every batch the recipient cursor (last processed users.id) and
+    counters are checkpointed, so a restarted job continues after it.
+    Before every batch the job status is read back, so a pause or cancel
+    written by another process stops the job too.
+    """
+
+    max_attempts = 3
+
+    def __init__(
+        self,
+        bot: Bot,
+        job_id: int,
+        rate: float = Config.BROADCAST_RATE,
+        workers: int = Config.BROADCAST_WORKERS,
+        batch_size: int = Config.BROADCAST_CHUNK_SIZE,
+        progress_interval: float = Config.BROADCAST_PROGRESS_INTERVAL
+    ):
+        self.bot = bot
+        self.job_id = job_id
+        self.limiter = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(workers)
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+
+        # Requested state change: paused / cancelled / None (stop for restart)
+        self._stop_status: Optional[str] = "running"
+        self._stop = asyncio.Event()
+        self._last_progress = 0.0
+        self.unreachable: List[int] = []
+
+    async def _load_job(self) -> Broadcast:
+        async with read_session_maker() as session:
+            return await session.get(Broadcast, self.job_id)
+
+    async def _load_status(self) -> Optional[str]:
+        async with read_session_maker() as session:
+            result = await session.execute(select(Broadcast.status).where(Broadcast.id == self.job_id))
+            return result.scalar()
+
+    async def _next_batch(self, job: Broadcast) -> List[Tuple[int, int]]:
+        """Recipients after cursor as (users.id, tg_id)"""
+        async with read_session_maker() as session:
+            result = await session.execute(
+                select(User.id, User.tg_id)
+                .where(segment_filter(job.segment, job.created_at), User.id > job.last_user_id)
+                .order_by(User.id)
+                .limit(self.batch_size)
+            )
+            return [(row.id, row.tg_id) for row in result.all()]
+
+    async def _checkpoint(self, job: Broadcast, **values):
+        values.setdefault('updated_at', datetime.utcnow())
+        values.update(
+            last_user_id=job.last_user_id,
+            sent_count=job.sent_count,
+            failed_count=job.failed_count
+        )
+
+        async def write(session):
+            await session.execute(update(Broadcast).where(Broadcast.id == job.id).values(**values))
+
+        # Cursor must be durable before the next batch is sent
+        await write_queue.submit(write)
+
+    async def _send(self, job: Broadcast, tg_id: int) -> bool:
+        async with self.semaphore:
+            for _ in range(self.max_attempts):
+                await self.limiter.acquire()
+                try:
+                    await self.bot.copy_message(
+                        chat_id=tg_id,
+                        from_chat_id=job.from_chat_id,
+                        message_id=job.source_message_id
+                    )
+                    return True
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Broadcast #{job.id} flood wait: {e.retry_after}s")
+                    self.limiter.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    self.unreachable.append(tg_id)
+                    return False
+                except Exception:
+                    return False
+            return False
+
+    async def _report_progress(self, job: Broadcast, force: bool = False):
+        now = time.monotonic()
+        if not job.progress_message_id or (not force and now - self._last_progress < self.progress_interval):
+            return
+        self._last_progress = now
+
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job.progress_chat_id,
+                message_id=job.progress_message_id,
+                text=broadcast_progress_text(job),
+                reply_markup=broadcast_job_controls(job.id, job.status),
+                parse_mode="HTML"
+            )
+        except Exception:
+            pass
+
+    def request_stop(self, status: Optional[str]):
+        """Stop after current batch: 'paused', 'cancelled' or None (shutdown)"""
+        self._stop_status = status
+        self._stop.set()
+
+    async def run(self):
+        job = await self._load_job()
+        if job is None or job.status != "running":
+            return
+
+        if not job.total_count:
+            async with read_session_maker() as session:
+                result = await session.execute(
+                    select(func.count(User.id))
+                    .where(segment_filter(job.segment, job.created_at), User.id > job.last_user_id)
+                )
+                job.total_count = result.scalar() + job.sent_count + job.failed_count
+            await self._checkpoint(job, total_count=job.total_count)
+
+        while not self._stop.is_set():
+            status = await self._load_status()
+            if status != "running":
+                self.request_stop(status)
+                break
+
+            batch = await self._next_batch(job)
+            if not batch:
+                break
+
+            self.unreachable = []
+            results = await asyncio.gather(*(self._send(job, tg_id) for _, tg_id in batch))
+            mark_unreachable(self.unreachable)
+
+            job.sent_count += sum(1 for ok in results if ok)
+            job.failed_count += sum(1 for ok in results if not ok)
+            job.last_user_id = batch[-1][0]
+            await self._checkpoint(job)
+            await self._report_progress(job)
+
+        if self._stop.is_set():
+            if self._stop_status is None:
+                # Shutdown: stays running, resumed on next start
+                return
+            job.status = self._stop_status
+        else:
+            job.status = "completed"
+
+        await self._checkpoint(
+            job,
+            status=job.status,
+            completed_at=datetime.now() if job.status != "paused" else None
+        )
+        await self._report_progress(job, force=True)
+
+
+def broadcast_progress_text(job: Broadcast) -> str:
+    done = job.sent_count + job.failed_count
+    percent = int(done / job.total_count * 100) if job.total_count else 100
+
+    if job.status == "completed":
+        title = "✅ <b>XABAR YUBORILDI!</b>"
+    elif job.status == "paused":
+        title = f"⏸ <b>TO'XTATILDI</b> ({percent}%)"
+    elif job.status == "cancelled":
+        title = f"🛑 <b>BEKOR QILINDI</b> ({percent}%)"
+    else:
+        title = f"📤 Xabar yuborilmoqda... {percent}%"
+
+    return f"""
+{title}
+
+🆔 Job: #{job.id}
+🎯 Auditoriya: {segment_label(job.segment)}
+✅ Muvaffaqiyatli: {job.sent_count} ta
+❌ Xato: {job.failed_count} ta
+📊 Jami: {job.total_count} ta
+    """
+
+
+# Running engines by job id
+running_broadcasts: Dict[int, BroadcastEngine] = {}
+broadcast_tasks: Set[asyncio.Task] = set()
+
+
+def start_broadcast(bot: Bot, job_id: int) -> Optional[asyncio.Task]:
+    """Run broadcast job in background"""
+    if job_id in running_broadcasts:
+        return None
+
+    engine = BroadcastEngine(bot, job_id)
+    running_broadcasts[job_id] = engine
+    task = asyncio.create_task(engine.run())
+    broadcast_tasks.add(task)
+
+    def _done(finished: asyncio.Task):
+        broadcast_tasks.discard(finished)
+        running_broadcasts.pop(job_id, None)
+        if not finished.cancelled() and finished.exception():
+            logger.error(f"Broadcast #{job_id} failed: {finished.exception()}")
+
+    task.add_done_callback(_done)
+    return task
+
+
+async def create_broadcast_job(
+    from_chat_id: int,
+    message_id: int,
+    created_by: int,
+    progress_chat_id: int,
+    progress_message_id: int,
+    segment: str = "all",
+    created_at: Optional[datetime] = None
+) -> int:
+    segment_filter(segment)  # validate
+
+    async with async_session_maker() as session:
+        job = Broadcast(
+            message_text="Broadcast message",
+            created_by=created_by,
+            status="running",
+            segment=segment,
+            from_chat_id=from_chat_id,
+            source_message_id=message_id,
+            last_user_id=0,
+            progress_chat_id=progress_chat_id,
+            progress_message_id=progress_message_id,
+            created_at=created_at or datetime.utcnow(),
+            updated_at=datetime.utcnow()
+        )
+        session.add(job)
+        await session.commit()
+        return job.id
+
+
+async def set_broadcast_status(bot: Bot, job_id: int, status: str) -> bool:
+    """Pause / resume / cancel a job, False if not possible
+
+    A job running in this process stops after its current batch; one
+    running in another process reads the new status before its next batch.
+    """
+    engine = running_broadcasts.get(job_id)
+
+    if status in ("paused", "cancelled") and engine:
+        engine.request_stop(status)
+        return True
+
+    async with async_session_maker() as session:
+        job = await session.get(Broadcast, job_id)
+        if job is None or job.status in ("completed", "cancelled"):
+            return False
+
+        if status == "running" and job.status == "paused":
+            job.status = "running"
+            await session.commit()
+            start_broadcast(bot, job_id)
+            return True
+
+        if status == "paused" and job.status == "running":
+            job.status = "paused"
+            await session.commit()
+            return True
+
+        if status == "cancelled":
+            job.status = "cancelled"
+            job.completed_at = datetime.now()
+            await session.commit()
+            return True
+
+    return False
+
+
+async def resume_broadcasts(bot: Bot) -> int:
+    """Restart jobs interrupted by shutdown or crash"""
+    async with async_session_maker() as session:
+        result = await session.execute(select(Broadcast.id).where(Broadcast.status == "running"))
+        job_ids = result.scalars().all()
+
+    for job_id in job_ids:
+        start_broadcast(bot, job_id)
+    return len(job_ids)
+
+
+async def stop_broadcasts():
+    """Checkpoint running jobs on shutdown (they resume on next start)"""
+    for engine in list(running_broadcasts.values()):
+        engine.request_stop(None)
+    if broadcast_tasks:
+        await asyncio.gather(*broadcast_tasks, return_exceptions=True)
@@ -0,0 +1,192 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from config import Config
+
+
+class SubscriptionCache:
+    """LRU cache of (user, channel) membership results with separate TTLs"""
+
+    def __init__(self, positive_ttl: float = 300, negative_ttl: float = 30, max_size: int = 10000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[int, int], Tuple[bool, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int, channel_id: int) -> Optional[bool]:
+        """Return cached membership or None if missing/expired"""
+        key = (user_id, channel_id)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        is_member, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return is_member
+
+    def set(self, user_id: int, channel_id: int, is_member: bool):
+        """Store membership result"""
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        key = (user_id, channel_id)
+
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        """Drop all cached results of a user"""
+        for key in [key for key in self._entries if key[0] == user_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Get cache counters"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+class UserSnapshot:
+    """Lightweight copy of the fields needed on every update"""
+
+    __slots__ = ('id', 'tg_id', 'first_name', 'username', 'is_admin', 'is_blocked')
+
+    def __init__(self, user, is_admin: bool = False):
+        self.id = user.id
+        self.tg_id = user.tg_id
+        self.first_name = user.first_name
+        self.username = user.username
+        self.is_admin = bool(user.is_admin) or is_admin
+        self.is_blocked = bool(user.is_blocked)
+
+
+class UserCache:
+    """LRU + TTL cache of user snapshots keyed by Telegram id"""
+
+    def __init__(self, ttl: float = 60, max_size: int = 50000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, Tuple[UserSnapshot, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tg_id: int) -> Optional[UserSnapshot]:
+        entry = self._entries.get(tg_id)
+
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[tg_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(tg_id)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, snapshot: UserSnapshot):
+        self._entries[snapshot.tg_id] = (snapshot, time.monotonic() + self.ttl)
+        self._entries.move_to_end(snapshot.tg_id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, tg_id: int):
+        """Drop snapshot after block/admin changes"""
+        self._entries.pop(tg_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+class QueryCache:
+    """LRU + TTL cache of answered search queries"""
+
+    def __init__(self, ttl: float = 60, max_size: int = 2000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+subscription_cache = SubscriptionCache(
+    positive_ttl=Config.SUBSCRIPTION_CACHE_POSITIVE_TTL,
+    negative_ttl=Config.SUBSCRIPTION_CACHE_NEGATIVE_TTL,
+    max_size=Config.SUBSCRIPTION_CACHE_SIZE
+)
+user_cache = UserCache(
+    ttl=Config.USER_CACHE_TTL,
+    max_size=Config.USER_CACHE_SIZE
+)
+inline_query_cache = QueryCache(
+    ttl=Config.INLINE_QUERY_CACHE_TTL,
+    max_size=Config.INLINE_QUERY_CACHE_SIZE
+)
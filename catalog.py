@@ -0,0 +1,181 @@
+import random
+import sys
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Movie
+from config import Config
+
+
+class CatalogEntry:
+    """Snapshot of an active movie kept in memory"""
+
+    __slots__ = ('id', 'code', 'file_id', 'title', 'description', 'views', 'likes', 'dislikes')
+
+    def __init__(self, movie: Movie):
+        self.id = movie.id
+        self.code = movie.code
+        self.file_id = movie.file_id
+        self.title = movie.title
+        self.description = movie.description
+        self.views = movie.views or 0
+        self.likes = movie.likes or 0
+        self.dislikes = movie.dislikes or 0
+
+
+class MovieCatalog:
+    """Array-backed index of active movies by numeric code"""
+
+    def __init__(self, code_length: int = Config.CODE_LENGTH):
+        self.size = 10 ** code_length
+        self._slots: List[Optional[CatalogEntry]] = [None] * self.size
+        self._by_id: Dict[int, CatalogEntry] = {}
+        self.loaded = False
+
+    def _slot(self, code: str) -> Optional[int]:
+        if not code.isdigit():
+            return None
+        index = int(code)
+        return index if index < self.size else None
+
+    async def load(self, db: AsyncSession) -> int:
+        """(Re)build index from active movies"""
+        result = await db.execute(select(Movie).where(Movie.is_active == True))
+        movies = result.scalars().all()
+
+        slots: List[Optional[CatalogEntry]] = [None] * self.size
+        by_id = {}
+        for movie in movies:
+            index = self._slot(movie.code)
+            if index is None:
+                continue
+            entry = CatalogEntry(movie)
+            slots[index] = entry
+            by_id[entry.id] = entry
+
+        # Swap in one step so lookups never see a half-built index
+        self._slots, self._by_id = slots, by_id
+        self.loaded = True
+        return len(by_id)
+
+    def get(self, code: str) -> Optional[CatalogEntry]:
+        """Find active movie by code"""
+        index = self._slot(code)
+        return self._slots[index] if index is not None else None
+
+    def get_by_id(self, movie_id: int) -> Optional[CatalogEntry]:
+        return self._by_id.get(movie_id)
+
+    def entries(self) -> List[CatalogEntry]:
+        return list(self._by_id.values())
+
+    def add(self, movie: Movie):
+        """Insert or replace movie"""
+        index = self._slot(movie.code)
+        if index is None or not movie.is_active:
+            return
+        self.remove(movie.id)
+        entry = CatalogEntry(movie)
+        self._slots[index] = entry
+        self._by_id[entry.id] = entry
+
+    def remove(self, movie_id: int):
+        """Drop movie from index"""
+        entry = self._by_id.pop(movie_id, None)
+        if entry is None:
+            return
+        index = self._slot(entry.code)
+        if index is not None and self._slots[index] is entry:
+            self._slots[index] = None
+
+    def memory_usage(self) -> int:
+        """Approximate index size in bytes"""
+        total = sys.getsizeof(self._slots) + sys.getsizeof(self._by_id)
+        for entry in self._by_id.values():
+            total += sys.getsizeof(entry)
+            for name in CatalogEntry.__slots__:
+                value = getattr(entry, name)
+                if isinstance(value, str):
+                    total += sys.getsizeof(value)
+        return total
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+class CodeAllocator:
+    """Bitmap-backed pool of free movie codes
+
+    A code is reserved synchronously (no await between check and mark),
+    so concurrent admins on the event loop never receive the same code.
+    """
+
+    def __init__(self, code_length: int = Config.CODE_LENGTH):
+        self.code_length = code_length
+        self.size = 10 ** code_length
+        self._used = bytearray(self.size)
+        self._free: List[int] = []
+        self._position: Dict[int, int] = {}
+        self.loaded = False
+
+    async def load(self, db: AsyncSession) -> int:
+        """Build pool from codes taken in movies table (active or not)"""
+        result = await db.execute(select(Movie.code))
+        used = bytearray(self.size)
+        for (code,) in result.all():
+            if code and code.isdigit() and int(code) < self.size:
+                used[int(code)] = 1
+
+        free = [index for index in range(self.size) if not used[index]]
+        self._used = used
+        self._free = free
+        self._position = {index: position for position, index in enumerate(free)}
+        self.loaded = True
+        return len(free)
+
+    def allocate(self) -> str:
+        """Reserve random free code in O(1)"""
+        if not self._free:
+            raise ValueError("No free movie codes left")
+
+        position = random.randrange(len(self._free))
+        index = self._free[position]
+        self._take(position)
+        self._used[index] = 1
+        return str(index).zfill(self.code_length)
+
+    def release(self, code: str):
+        """Return code to pool"""
+        if not code.isdigit() or int(code) >= self.size:
+            return
+        index = int(code)
+        if not self._used[index]:
+            return
+        self._used[index] = 0
+        self._position[index] = len(self._free)
+        self._free.append(index)
+
+    def _take(self, position: int):
+        # Swap with last element and pop
+        index = self._free[position]
+        last = self._free.pop()
+        if last != index:
+            self._free[position] = last
+            self._position[last] = position
+        del self._position[index]
+
+    def stats(self) -> Dict[str, float]:
+        """Get pool usage"""
+        used = self.size - len(self._free)
+        return {
+            'used': used,
+            'free': len(self._free),
+            'size': self.size,
+            'fill_percent': round(used / self.size * 100, 1)
+        }
+
+
+movie_catalog = MovieCatalog()
+code_allocator = CodeAllocator()
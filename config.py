@@ -1,3 +1,4 @@
+import math
 import os
 from dotenv import load_dotenv
 
@@ -5,14 +6,65 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+def parse_sample_rates(value: str) -> dict:
+    """"category=rate,..." -> {category: rate}, bad entries skipped, rates clamped to 0..1"""
+    rates = {}
+    for item in value.split(","):
+        category, _, rate = item.partition("=")
+        category = category.strip()
+        if not category and not rate.strip():
+            continue
+        try:
+            share = float(rate)
+        except ValueError:
+            share = math.nan
+        if not category or math.isnan(share):
+            # Logging isn't set up yet (it reads these rates)
+            print(f"⚠️ LOG_SAMPLE_RATES: skipped bad entry {item.strip()!r}")
+            continue
+        rates[category] = min(max(share, 0.0), 1.0)
+    return rates
+
+
 class Config:
     """Bot configuration"""
     
     # Bot settings
     BOT_TOKEN = os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN")
     
+    # Update delivery: "polling" or "webhook"
+    UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base URL, empty = don't register (local testing)
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")  # behind a local reverse proxy
+    WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+    
+    # Worker processes (updates sharded by user id), 0 or 1 = single process
+    WORKERS = int(os.getenv("WORKERS", "0"))
+    ADMIN_WORKER = os.getenv("ADMIN_WORKER", "true").lower() == "true"  # extra worker for admins and broadcasts
+    CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))  # workers reload movies and DB admins
+    WORKER_MAX_RESTARTS = int(os.getenv("WORKER_MAX_RESTARTS", "5"))  # crashed worker restarts, then everything stops
+    
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./kinamax.db")
+    DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"  # log every SQL statement
+    
+    # SQLite profile (applied on every connection)
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # safe with WAL
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB (64MB)
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # ms
+    
+    # Single writer: operations per group commit / wait for more (seconds)
+    WRITE_QUEUE_MAX_BATCH = int(os.getenv("WRITE_QUEUE_MAX_BATCH", "200"))
+    WRITE_QUEUE_MAX_DELAY = float(os.getenv("WRITE_QUEUE_MAX_DELAY", "0.005"))
+    
+    # Server databases (PostgreSQL / MySQL) connection pool
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
     
     # Admin IDs
     ADMIN_IDS = [
@@ -28,6 +80,66 @@ class Config:
     MOVIES_PER_PAGE = 10
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
     CODE_LENGTH = 4
+
+    # Subscription check cache (seconds)
+    SUBSCRIPTION_CACHE_POSITIVE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_POSITIVE_TTL", "300"))
+    SUBSCRIPTION_CACHE_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_NEGATIVE_TTL", "30"))
+    SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+
+    # Subscription check: concurrency, timeout (seconds) and policies
+    SUBSCRIPTION_CHECK_CONCURRENCY = int(os.getenv("SUBSCRIPTION_CHECK_CONCURRENCY", "10"))
+    SUBSCRIPTION_CHECK_TIMEOUT = float(os.getenv("SUBSCRIPTION_CHECK_TIMEOUT", "3"))
+    SUBSCRIPTION_FAIL_OPEN = os.getenv("SUBSCRIPTION_FAIL_OPEN", "false").lower() == "true"
+    SUBSCRIPTION_STOP_ON_FIRST_FAILURE = os.getenv("SUBSCRIPTION_STOP_ON_FIRST_FAILURE", "false").lower() == "true"
+
+    # View counters write-behind (seconds / pending rows)
+    VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "10"))
+    VIEW_FLUSH_SIZE = int(os.getenv("VIEW_FLUSH_SIZE", "500"))
+    
+    # last_active tracking (seconds)
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+    ACTIVITY_WRITE_WINDOW = float(os.getenv("ACTIVITY_WRITE_WINDOW", "60"))
+    
+    # Statistics rollups refresh (seconds)
+    STATS_ROLLUP_INTERVAL = float(os.getenv("STATS_ROLLUP_INTERVAL", "300"))
+    
+    # Top movies / users leaderboards
+    LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+    LEADERBOARD_SLACK = int(os.getenv("LEADERBOARD_SLACK", "40"))  # extra entries kept beyond the top
+    LEADERBOARD_RECONCILE_INTERVAL = float(os.getenv("LEADERBOARD_RECONCILE_INTERVAL", "600"))
+    
+    # Inline mode (@bot <text>)
+    INLINE_RESULTS_PER_PAGE = int(os.getenv("INLINE_RESULTS_PER_PAGE", "20"))  # Telegram allows up to 50
+    INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))  # seconds Telegram may reuse an answer
+    INLINE_QUERY_CACHE_TTL = float(os.getenv("INLINE_QUERY_CACHE_TTL", "60"))
+    INLINE_QUERY_CACHE_SIZE = int(os.getenv("INLINE_QUERY_CACHE_SIZE", "2000"))
+    
+    # FSM storage (fsm_states table)
+    FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))  # abandoned conversations expire
+    FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "60"))  # in-process reads, 0 = always read DB
+    FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+    FSM_CLEANUP_INTERVAL = float(os.getenv("FSM_CLEANUP_INTERVAL", "3600"))
+    
+    # Per-id keyboards kept built (rating buttons, confirmations)
+    KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", "4096"))
+    
+    # Logging (logs/ files rotate by size, rotated ones are gzipped)
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    # Share of INFO lines kept per logger category: "events=0.1,sqlalchemy.engine=0.01"
+    # (aiogram.event: aiogram's own "Update id=... is handled" line)
+    LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "events=0.1,aiogram.event=0.1"))
+    LOG_SLOW_UPDATE = float(os.getenv("LOG_SLOW_UPDATE", "1"))  # seconds, slower updates are always logged
+    
+    # User snapshot cache
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+    
+    # Broadcast (Telegram allows ~30 messages/second per bot)
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+    BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "20"))
+    BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "100"))  # recipients per checkpoint
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
     
     # Messages
     WELCOME_MESSAGE = """
@@ -65,6 +177,12 @@ Iltimos, to'g'ri kodni kiriting yoki admin bilan bog'laning.
         if not cls.ADMIN_IDS:
             errors.append("ADMIN_IDS is not set!")
         
+        if cls.UPDATE_MODE not in ("polling", "webhook"):
+            errors.append("UPDATE_MODE must be polling or webhook!")
+        
+        if cls.UPDATE_MODE == "webhook" and not cls.WEBHOOK_SECRET:
+            errors.append("WEBHOOK_SECRET is not set!")
+        
         if errors:
             raise ValueError("Configuration errors:\n" + "\n".join(errors))
     
@@ -74,6 +192,7 @@ Iltimos, to'g'ri kodni kiriting yoki admin bilan bog'laning.
         return f"""
 🔧 Bot Configuration:
 ├─ Database: {cls.DATABASE_URL.split('///')[0]}
+├─ Updates: {cls.UPDATE_MODE}{f" ({cls.WORKERS} workers)" if cls.WORKERS > 1 else ""}
 ├─ Admins: {len(cls.ADMIN_IDS)}
 ├─ Movies per page: {cls.MOVIES_PER_PAGE}
 └─ Max file size: {cls.MAX_FILE_SIZE / (1024*1024):.0f}MB
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import update, bindparam
+
+from database import Movie, User
+from config import Config
+from writer import write_queue
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher(ABC):
+    """Background loop that calls flush() on a timer or when woken up"""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @abstractmethod
+    async def flush(self):
+        """Write or refresh whatever is pending (errors are handled inside)"""
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                # stop() does the final flush
+                return
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop background loop and write everything left (one last flush)"""
+        if self._task is not None:
+            # Not cancelled: a flush in progress must finish its transaction
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class ViewCounterBuffer(PeriodicFlusher):
+    """Aggregates movie views / user watch counters and flushes them in batches"""
+
+    def __init__(self, flush_interval: float = 10, flush_size: int = 500):
+        super().__init__(flush_interval)
+        self.flush_size = flush_size
+        self._movie_views: Dict[int, int] = defaultdict(int)
+        self._user_watches: Dict[int, int] = defaultdict(int)
+        self._lock = asyncio.Lock()
+        # Called with (movie_views, user_watches) deltas after each written batch
+        self.flush_listeners: List[Callable[[Dict[int, int], Dict[int, int]], Awaitable[None]]] = []
+
+    @property
+    def flush_lock(self) -> asyncio.Lock:
+        """Held while a batch is written and listeners run"""
+        return self._lock
+
+    def record_view(self, movie_id: int, user_id: int):
+        """Count one delivered movie (user_id is users.id)"""
+        self._movie_views[movie_id] += 1
+        self._user_watches[user_id] += 1
+
+        if len(self._movie_views) + len(self._user_watches) >= self.flush_size:
+            self._wakeup.set()
+
+    def pending_user_watches(self, user_id: int) -> int:
+        """Watches not yet written to DB"""
+        return self._user_watches.get(user_id, 0)
+
+    def pending_movie_views(self, movie_id: int) -> int:
+        return self._movie_views.get(movie_id, 0)
+
+    async def flush(self):
+        """Write pending deltas as atomic increments in one transaction"""
+        async with self._lock:
+            if not self._movie_views and not self._user_watches:
+                return
+
+            movie_views, self._movie_views = self._movie_views, defaultdict(int)
+            user_watches, self._user_watches = self._user_watches, defaultdict(int)
+
+            movies = Movie.__table__
+            users = User.__table__
+
+            async def write(session):
+                if movie_views:
+                    await session.execute(
+                        update(movies)
+                        .where(movies.c.id == bindparam('row_id'))
+                        .values(views=movies.c.views + bindparam('delta')),
+                        [{'row_id': row_id, 'delta': delta} for row_id, delta in movie_views.items()]
+                    )
+                if user_watches:
+                    await session.execute(
+                        update(users)
+                        .where(users.c.id == bindparam('row_id'))
+                        .values(watched_movies=users.c.watched_movies + bindparam('delta')),
+                        [{'row_id': row_id, 'delta': delta} for row_id, delta in user_watches.items()]
+                    )
+
+            try:
+                await write_queue.submit(write)
+            except Exception as e:
+                logger.error(f"View counter flush failed, will retry: {e}")
+                # Put deltas back so nothing is lost
+                for row_id, delta in movie_views.items():
+                    self._movie_views[row_id] += delta
+                for row_id, delta in user_watches.items():
+                    self._user_watches[row_id] += delta
+                return
+
+            logger.debug(f"Flushed views: {len(movie_views)} movies, {len(user_watches)} users")
+
+            for listener in self.flush_listeners:
+                try:
+                    await listener(movie_views, user_watches)
+                except Exception as e:
+                    logger.error(f"View flush listener failed: {e}")
+
+
+class ActivityTracker(PeriodicFlusher):
+    """Coalesces users.last_active writes into periodic bulk updates"""
+
+    def __init__(self, flush_interval: float = 30, write_window: float = 60):
+        super().__init__(flush_interval)
+        self.write_window = timedelta(seconds=write_window)
+        self._pending: Dict[int, datetime] = {}
+        self._written: Dict[int, datetime] = {}
+        self._lock = asyncio.Lock()
+
+    def touch(self, tg_id: int):
+        """Record activity of a user (by Telegram id)"""
+        now = datetime.utcnow()
+        written_at = self._written.get(tg_id)
+
+        # Already stored recently enough, skip
+        if written_at is not None and now - written_at < self.write_window:
+            return
+
+        self._pending[tg_id] = now
+
+    async def flush(self):
+        """Write pending timestamps in one bulk UPDATE"""
+        async with self._lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+            users = User.__table__
+
+            async def write(session):
+                await session.execute(
+                    update(users)
+                    .where(users.c.tg_id == bindparam('user_tg_id'))
+                    .values(last_active=bindparam('active_at')),
+                    [{'user_tg_id': tg_id, 'active_at': active_at} for tg_id, active_at in pending.items()]
+                )
+
+            try:
+                await write_queue.submit(write)
+            except Exception as e:
+                logger.error(f"Activity flush failed, will retry: {e}")
+                for tg_id, active_at in pending.items():
+                    self._pending.setdefault(tg_id, active_at)
+                return
+
+            self._written.update(pending)
+
+            # Forget users whose window has passed to keep memory bounded
+            cutoff = datetime.utcnow() - self.write_window
+            self._written = {
+                tg_id: written_at for tg_id, written_at in self._written.items()
+                if written_at >= cutoff
+            }
+
+
+view_counter = ViewCounterBuffer(
+    flush_interval=Config.VIEW_FLUSH_INTERVAL,
+    flush_size=Config.VIEW_FLUSH_SIZE
+)
+activity_tracker = ActivityTracker(
+    flush_interval=Config.ACTIVITY_FLUSH_INTERVAL,
+    write_window=Config.ACTIVITY_WRITE_WINDOW
+)
@@ -1,17 +1,93 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, Text, ForeignKey
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+import logging
+import re
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, Text, ForeignKey, Index, inspect, text, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, relationship
 from datetime import datetime
-from typing import AsyncGenerator
-import os
+from typing import AsyncGenerator, Optional
+
+from config import Config
 
 # Database URL
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./kinamax.db")
+DATABASE_URL = Config.DATABASE_URL
+
+
+def sqlite_pragmas() -> list:
+    return [
+        "journal_mode=WAL",  # readers don't block the writer
+        f"synchronous={Config.SQLITE_SYNCHRONOUS}",
+        f"cache_size={Config.SQLITE_CACHE_SIZE}",
+        f"mmap_size={Config.SQLITE_MMAP_SIZE}",
+        f"busy_timeout={Config.SQLITE_BUSY_TIMEOUT}",  # wait for the lock instead of failing
+        "temp_store=MEMORY"
+    ]
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in sqlite_pragmas():
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+def _apply_sqlite_read_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def is_sqlite(url: str = DATABASE_URL) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def create_engine_for_url(url: str = DATABASE_URL, echo: bool = Config.DB_ECHO, read_only: bool = False) -> AsyncEngine:
+    """Create engine with the profile of the database backend"""
+    if echo:
+        # Not engine echo (it adds its own stdout handler): SQL goes through
+        # the logging queue and is sampled as "sqlalchemy.engine"
+        logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+    
+    if is_sqlite(url):
+        engine = create_async_engine(
+            url,
+            connect_args={"timeout": Config.SQLITE_BUSY_TIMEOUT / 1000}
+        )
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        if read_only:
+            event.listen(engine.sync_engine, "connect", _apply_sqlite_read_only)
+        return engine
+    
+    # PostgreSQL / MySQL
+    return create_async_engine(
+        url,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
 
 # Engine va Session
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_engine_for_url()
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# Read-only sessions: under WAL SQLite readers run beside the single writer
+read_engine = create_engine_for_url(read_only=True) if is_sqlite() else engine
+read_session_maker = async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def begin_write(session: AsyncSession):
+    """Start a write transaction holding the SQLite write lock from the first read
+    
+    A deferred transaction that reads and then writes fails at once when
+    another process wrote in between; BEGIN IMMEDIATE waits busy_timeout.
+    """
+    if is_sqlite():
+        await session.execute(text("BEGIN IMMEDIATE"))
+
 
 class Base(DeclarativeBase):
     pass
@@ -26,10 +102,11 @@ class User(Base):
     username = Column(String(255), nullable=True)
     is_admin = Column(Boolean, default=False)
     is_blocked = Column(Boolean, default=False)
-    watched_movies = Column(Integer, default=0)
+    is_unreachable = Column(Boolean, default=False, index=True)  # user blocked the bot
+    watched_movies = Column(Integer, default=0, index=True)
     total_ratings = Column(Integer, default=0)
-    joined_at = Column(DateTime, default=datetime.utcnow)
-    last_active = Column(DateTime, default=datetime.utcnow)
+    joined_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_active = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     ratings = relationship("Rating", back_populates="user", cascade="all, delete-orphan")
@@ -45,16 +122,21 @@ class Movie(Base):
     description = Column(Text, nullable=True)
     file_id = Column(String(500), nullable=False)
     channel_message_id = Column(Integer, nullable=True)
-    views = Column(Integer, default=0)
+    views = Column(Integer, default=0, index=True)
     likes = Column(Integer, default=0)
     dislikes = Column(Integer, default=0)
     average_rating = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     created_by = Column(BigInteger, nullable=True)
     is_active = Column(Boolean, default=True)
     
     # Relationships
     ratings = relationship("Rating", back_populates="movie", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Admin movie list: keyset pagination on (created_at, id)
+        Index("ix_movies_active_created_id", "is_active", "created_at", "id"),
+    )
 
 
 class Channel(Base):
@@ -94,11 +176,16 @@ class Rating(Base):
     movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"))
     rating_type = Column(String(10))  # like/dislike
     stars = Column(Integer, nullable=True)  # 1-5 stars
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     user = relationship("User", back_populates="ratings")
     movie = relationship("Movie", back_populates="ratings")
+    
+    __table_args__ = (
+        # "Already rated" checks and rated-movie broadcast segments
+        Index("ix_ratings_movie_user", "movie_id", "user_id"),
+    )
 
 
 class Stats(Base):
@@ -113,6 +200,16 @@ class Stats(Base):
     total_views = Column(Integer, default=0)
     total_ratings = Column(Integer, default=0)
     stats_type = Column(String(20), default="daily")  # daily/weekly/monthly
+    
+    # Rollup details (see rollups.StatsRollup)
+    new_movies = Column(Integer, default=0)
+    new_ratings = Column(Integer, default=0)
+    unreachable_users = Column(Integer, default=0)
+    updated_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_stats_type_date", "stats_type", "date", unique=True),
+    )
 
 
 class Broadcast(Base):
@@ -125,29 +222,191 @@ class Broadcast(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     created_by = Column(BigInteger, nullable=False)
+    
+    # Job state (resumable broadcasts)
+    status = Column(String(20), default="completed", index=True)  # running/paused/cancelled/completed
+    from_chat_id = Column(BigInteger, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
+    last_user_id = Column(Integer, default=0)  # recipient cursor (users.id)
+    segment = Column(String(50), default="all")  # audience, see broadcast.segment_filter
+    total_count = Column(Integer, default=0)
+    progress_chat_id = Column(BigInteger, nullable=True)
+    progress_message_id = Column(Integer, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
 
 
-# Database dependency
-async def get_db() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+class FSMRecord(Base):
+    __tablename__ = "fsm_states"
+    
+    key = Column(String(255), primary_key=True)  # aiogram storage key
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+
+# Raw SQL that only reads
+READ_SQL = re.compile(r"\s*(SELECT|EXPLAIN)\b", re.IGNORECASE)
+
+
+class LazySession:
+    """AsyncSession proxy that opens the real session on first use
+    
+    Handlers that never touch the DB cost no session, and commit is
+    skipped when nothing was written.
+    """
+    
+    def __init__(self, session_maker: async_sessionmaker = None):
+        self._session_maker = session_maker or async_session_maker
+        self._session: Optional[AsyncSession] = None
+        self._has_writes = False
+    
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+    
+    @property
+    def has_writes(self) -> bool:
+        session = self._session
+        return session is not None and bool(
+            self._has_writes or session.new or session.dirty or session.deleted
+        )
+    
+    def _get_session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_maker()
+            # Writes reach the DB by flushes (autoflush included) or DML
+            # statements (ORM or text, also via scalar()); either means commit
+            event.listen(self._session.sync_session, "after_flush", self._mark_writes)
+            event.listen(self._session.sync_session, "do_orm_execute", self._on_execute)
+        return self._session
+    
+    def _mark_writes(self, *args):
+        self._has_writes = True
+    
+    def _on_execute(self, orm_execute_state):
+        statement = orm_execute_state.statement
+        if isinstance(statement, TextClause):
+            # Raw SQL (e.g. FTS search): only queries are reads
+            writes = not READ_SQL.match(statement.text)
+        else:
+            writes = orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+        if writes:
+            self._has_writes = True
+    
+    async def commit(self):
+        if self._session is not None:
+            await self._session.commit()
+            self._has_writes = False
+    
+    async def rollback(self):
+        if self._session is not None:
+            await self._session.rollback()
+            self._has_writes = False
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    def __getattr__(self, name):
+        # add, delete, get, refresh, scalar ... open the session
+        return getattr(self._get_session(), name)
+    
+    async def __aenter__(self) -> "LazySession":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
         try:
-            yield session
-            await session.commit()
-        except Exception:
-            await session.rollback()
-            raise
+            if exc_type is not None:
+                await self.rollback()
+            elif self.has_writes:
+                await self.commit()
         finally:
-            await session.close()
+            await self.close()
+
+
+# Database dependency
+async def get_db() -> AsyncGenerator[LazySession, None]:
+    async with LazySession() as session:
+        yield session
+
+
+# Add columns / indexes that create_all does not add to existing tables
+def upgrade_schema(connection):
+    inspector = inspect(connection)
+    
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if isinstance(default, bool):
+                ddl += f" DEFAULT {int(default)}"
+            elif isinstance(default, (int, float)):
+                ddl += f" DEFAULT {default}"
+            elif isinstance(default, str):
+                ddl += f" DEFAULT '{default}'"
+            connection.execute(text(ddl))
+        
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+# Full-text index of movie titles / descriptions (SQLite FTS5)
+MOVIES_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_insert AFTER INSERT ON movies BEGIN
+        INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_delete AFTER DELETE ON movies BEGIN
+        INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    # Counter updates (views, likes) don't touch the index
+    """CREATE TRIGGER IF NOT EXISTS movies_fts_update AFTER UPDATE OF title, description ON movies BEGIN
+        INSERT INTO movies_fts(movies_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO movies_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+
+def setup_fulltext(connection):
+    inspector = inspect(connection)
+    created = not inspector.has_table("movies_fts")
+    
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5("
+        "title, description, content='movies', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    ))
+    for trigger in MOVIES_FTS_TRIGGERS:
+        connection.execute(text(trigger))
+    
+    if created:
+        # Title matches rank above description matches
+        connection.execute(text("INSERT INTO movies_fts(movies_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"))
+        # Index movies that existed before the FTS table
+        connection.execute(text("INSERT INTO movies_fts(movies_fts) VALUES ('rebuild')"))
 
 
 # Initialize database
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+        if is_sqlite():
+            await conn.run_sync(setup_fulltext)
     print("✅ Database initialized successfully!")
 
 
 # Close database
 async def close_db():
+    if read_engine is not engine:
+        await read_engine.dispose()
     await engine.dispose()
     print("✅ Database connection closed!")
\ No newline at end of file
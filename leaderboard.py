@@ -0,0 +1,184 @@
+import heapq
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import select, desc
+
+from database import read_session_maker, User, Movie
+from catalog import movie_catalog
+from counters import PeriodicFlusher, view_counter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """Top-K of growing scores (views, watched movies)
+
+    Keeps the best `size + slack` entries. Everything left out scores no
+    higher than `floor`, so the top `size` is exact while the board holds
+    at least `size` entries (removals only shrink it).
+    """
+
+    def __init__(self, size: int = 10, slack: int = 40):
+        self.size = size
+        self.capacity = size + slack
+        self._scores: Dict[int, int] = {}
+        self.floor = -1
+        self.complete = True  # board holds every item
+
+    def seed(self, rows: Iterable[Tuple[int, int]]):
+        """Replace board with the best (key, score) rows, at most capacity"""
+        rows = heapq.nsmallest(self.capacity + 1, rows, key=lambda row: (-row[1], row[0]))
+
+        self.complete = len(rows) <= self.capacity
+        rows = rows[:self.capacity]
+        self._scores = dict(rows)
+        self.floor = -1 if self.complete else rows[-1][1]
+
+    def offer(self, key: int, score: int):
+        """Report new absolute score of an item"""
+        if key not in self._scores and not self.complete and score <= self.floor:
+            return
+
+        self._scores[key] = score
+
+        if len(self._scores) > self.capacity:
+            evicted = min(self._scores, key=lambda k: (self._scores[k], -k))
+            self.floor = max(self.floor, self._scores.pop(evicted))
+            self.complete = False
+
+    def increment(self, key: int, delta: int) -> bool:
+        """Add to a member's score, False if not on the board"""
+        if key not in self._scores:
+            return False
+        self._scores[key] += delta
+        return True
+
+    def remove(self, key: int):
+        self._scores.pop(key, None)
+
+    @property
+    def exact(self) -> bool:
+        return self.complete or len(self._scores) >= self.size
+
+    def top(self, limit: int = None) -> List[Tuple[int, int]]:
+        """Best (key, score) pairs, highest first"""
+        return heapq.nsmallest(limit or self.size, self._scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+movie_leaderboard = Leaderboard(size=Config.LEADERBOARD_SIZE, slack=Config.LEADERBOARD_SLACK)
+user_leaderboard = Leaderboard(size=Config.LEADERBOARD_SIZE, slack=Config.LEADERBOARD_SLACK)
+
+
+def seed_movie_leaderboard():
+    """Movies from the catalog (views include unflushed ones)"""
+    movie_leaderboard.seed((entry.id, entry.views) for entry in movie_catalog.entries())
+
+
+async def _top_users_sql(limit: int) -> List[Tuple[int, int]]:
+    # Users who watched nothing never enter the board
+    async with read_session_maker() as session:
+        result = await session.execute(
+            select(User.id, User.watched_movies)
+            .where(User.is_blocked == False, User.watched_movies > 0)
+            .order_by(desc(User.watched_movies), User.id)
+            .limit(limit)
+        )
+        return [(row.id, row.watched_movies or 0) for row in result.all()]
+
+
+async def seed_user_leaderboard():
+    # No flush may land between the query and the swap
+    async with view_counter.flush_lock:
+        user_leaderboard.seed(await _top_users_sql(user_leaderboard.capacity + 1))
+
+
+async def load_leaderboards():
+    seed_movie_leaderboard()
+    await seed_user_leaderboard()
+
+
+async def ensure_exact():
+    """Reseed boards that shrank below their size"""
+    if not movie_leaderboard.exact:
+        seed_movie_leaderboard()
+    if not user_leaderboard.exact:
+        await seed_user_leaderboard()
+
+
+async def on_views_flushed(movie_views: Dict[int, int], user_watches: Dict[int, int]):
+    """Apply written watch deltas to the users board"""
+    outsiders = [
+        user_id for user_id, delta in user_watches.items()
+        if not user_leaderboard.increment(user_id, delta)
+    ]
+    if not outsiders:
+        return
+
+    # Only rows that can enter the board
+    query = select(User.id, User.watched_movies).where(User.id.in_(outsiders), User.is_blocked == False)
+    if not user_leaderboard.complete:
+        query = query.where(User.watched_movies > user_leaderboard.floor)
+
+    async with read_session_maker() as session:
+        result = await session.execute(query)
+        for row in result.all():
+            user_leaderboard.offer(row.id, row.watched_movies)
+
+
+view_counter.flush_listeners.append(on_views_flushed)
+
+
+class LeaderboardReconciler(PeriodicFlusher):
+    """Periodically checks the boards against SQL and reseeds on mismatch"""
+
+    def __init__(self, flush_interval: float = 600):
+        super().__init__(flush_interval)
+        self.checks = 0
+        self.mismatches = 0
+
+    async def flush(self):
+        try:
+            await self.reconcile()
+        except Exception as e:
+            logger.error(f"Leaderboard reconcile failed: {e}")
+
+    async def reconcile(self) -> bool:
+        """True if both boards matched the SQL answer"""
+        await view_counter.flush()
+        size = Config.LEADERBOARD_SIZE
+        matched = True
+
+        async with view_counter.flush_lock:
+            async with read_session_maker() as session:
+                result = await session.execute(
+                    select(Movie.id, Movie.views)
+                    .where(Movie.is_active == True)
+                    .order_by(desc(Movie.views), Movie.id)
+                    .limit(movie_leaderboard.capacity)
+                )
+                # Views recorded after the flush are not in SQL yet
+                movies = [
+                    (row.id, (row.views or 0) + view_counter.pending_movie_views(row.id))
+                    for row in result.all()
+                ]
+            expected = sorted((score for _, score in movies), reverse=True)[:size]
+            if expected != [score for _, score in movie_leaderboard.top(size)]:
+                logger.warning("Movie leaderboard drifted from SQL, reseeding")
+                seed_movie_leaderboard()
+                matched = False
+
+            users = await _top_users_sql(size)
+            if [score for _, score in users] != [score for _, score in user_leaderboard.top(size)]:
+                logger.warning("User leaderboard drifted from SQL, reseeding")
+                user_leaderboard.seed(await _top_users_sql(user_leaderboard.capacity + 1))
+                matched = False
+
+        self.checks += 1
+        if not matched:
+            self.mismatches += 1
+        return matched
+
+
+leaderboard_reconciler = LeaderboardReconciler(flush_interval=Config.LEADERBOARD_RECONCILE_INTERVAL)
@@ -0,0 +1,105 @@
+import gzip
+import logging
+import os
+import queue
+import random
+import shutil
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
+from config import Config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of INFO/DEBUG records per logger category
+
+    Rates are matched by logger name prefix ("events" covers
+    "events.message"), the longest prefix wins. Warnings and errors
+    always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+        self.dropped = 0
+
+    def rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            matched = -1
+            for category, category_rate in self.rates.items():
+                if (name == category or name.startswith(category + ".")) and len(category) > matched:
+                    rate, matched = category_rate, len(category)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        if rate >= 1 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def setup_logging(filename: str = 'logs/bot.log') -> QueueListener:
+    """Route all logging through a queue, files are written by a listener thread
+
+    The event loop only puts records on the queue. Files rotate by size
+    and rotated ones are gzipped (in the listener thread).
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = RotatingFileHandler(
+        filename,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding='utf-8',
+        delay=True
+    )
+    file_handler.namer = lambda name: name + '.gz'
+    file_handler.rotator = _gzip_rotator
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(Config.LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(logging.INFO)
+
+    _listener = QueueListener(records, file_handler, stream_handler)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Write out queued records (call last on exit)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
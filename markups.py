@@ -0,0 +1,199 @@
+import logging
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
+
+import aiogram
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from aiohttp import FormData
+from pydantic import ConfigDict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+Markup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]
+
+# MarkupSession.build_form_data repeats AiohttpSession.build_form_data of
+# this aiogram release (same as requirements.txt), other releases use stock
+FORM_DATA_AIOGRAM_VERSION = "3.15.0"
+
+
+class FrozenList(list):
+    """List that raises on changes (still a list for pydantic and aiogram)"""
+
+    def _frozen(self, *args, **kwargs):
+        raise TypeError("shared keyboards can't be changed, build a new one")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _frozen
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _frozen
+
+
+# aiogram keyboards are mutable models: shared instances are frozen copies
+class FrozenInlineKeyboardButton(InlineKeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenInlineKeyboardMarkup(InlineKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenKeyboardButton(KeyboardButton):
+    model_config = ConfigDict(frozen=True)
+
+
+class FrozenReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    model_config = ConfigDict(frozen=True)
+
+
+FROZEN_TYPES = {
+    InlineKeyboardButton: FrozenInlineKeyboardButton,
+    InlineKeyboardMarkup: FrozenInlineKeyboardMarkup,
+    KeyboardButton: FrozenKeyboardButton,
+    ReplyKeyboardMarkup: FrozenReplyKeyboardMarkup,
+}
+for frozen_type in FROZEN_TYPES.values():
+    # aiogram defers schema builds, model_construct() would skip it
+    frozen_type.model_rebuild()
+
+
+def freeze(value: Any) -> Any:
+    """Copy of a keyboard that can't be changed: assignment and row edits raise"""
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+
+    frozen_type = FROZEN_TYPES.get(type(value))
+    if frozen_type is None:
+        return value
+    return frozen_type.model_construct(
+        _fields_set=value.model_fields_set,
+        **{name: freeze(getattr(value, name)) for name in value.model_fields}
+    )
+
+
+class MarkupCache:
+    """Built keyboards (frozen copies, so instances are shared) and their JSON
+
+    Static keyboards are kept forever, per-id ones in a bounded LRU.
+    JSON is filled in by MarkupSession on the first send.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._static: List[Markup] = []
+        self._markups: "OrderedDict[Hashable, Markup]" = OrderedDict()
+        self._payloads: Dict[int, Optional[str]] = {}  # id(markup) -> JSON
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, markup: Markup) -> Markup:
+        markup = freeze(markup)
+        self._static.append(markup)
+        self._payloads[id(markup)] = None
+        return markup
+
+    def get(self, key: Hashable, build: Callable[[], Markup]) -> Markup:
+        markup = self._markups.get(key)
+        if markup is not None:
+            self._markups.move_to_end(key)
+            self.hits += 1
+            return markup
+
+        self.misses += 1
+        markup = freeze(build())
+        self._markups[key] = markup
+        self._payloads[id(markup)] = None
+
+        while len(self._markups) > self.max_size:
+            _, evicted = self._markups.popitem(last=False)
+            self._payloads.pop(id(evicted), None)
+        return markup
+
+    def is_cached(self, markup) -> bool:
+        return id(markup) in self._payloads
+
+    def payload(self, markup) -> Optional[str]:
+        return self._payloads.get(id(markup))
+
+    def set_payload(self, markup, payload: str):
+        if id(markup) in self._payloads:
+            self._payloads[id(markup)] = payload
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'static': len(self._static),
+            'size': len(self._markups),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total * 100, 1) if total else 0.0
+        }
+
+
+markup_cache = MarkupCache(max_size=Config.KEYBOARD_CACHE_SIZE)
+
+
+def prebuilt(builder: Callable[[], Markup]) -> Callable[[], Markup]:
+    """Constant keyboard: built once at import"""
+    markup = markup_cache.register(builder())
+
+    @wraps(builder)
+    def get() -> Markup:
+        return markup
+
+    return get
+
+
+def cached(builder: Callable[..., Markup]) -> Callable[..., Markup]:
+    """Keyboard built from hashable arguments (ids, codes): memoized in the LRU"""
+
+    @wraps(builder)
+    def get(*args, **kwargs) -> Markup:
+        key = (builder.__module__, builder.__qualname__, args, tuple(sorted(kwargs.items())))
+        return markup_cache.get(key, lambda: builder(*args, **kwargs))
+
+    return get
+
+
+class MarkupSession(AiohttpSession):
+    """Sends cached keyboards as stored JSON instead of dumping the models"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.use_payloads = aiogram.__version__ == FORM_DATA_AIOGRAM_VERSION
+        if not self.use_payloads:
+            logger.warning(
+                f"aiogram {aiogram.__version__} != {FORM_DATA_AIOGRAM_VERSION}: "
+                "keyboard JSON cache disabled, check MarkupSession.build_form_data"
+            )
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup = getattr(method, "reply_markup", None)
+        if not self.use_payloads or markup is None or not markup_cache.is_cached(markup):
+            return super().build_form_data(bot, method)
+
+        payload = markup_cache.payload(markup)
+        if payload is None:
+            payload = self.prepare_value(markup, bot=bot, files={})
+            markup_cache.set_payload(markup, payload)
+
+        # Same as AiohttpSession.build_form_data (aiogram 3.15.0), reply_markup added last
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", payload)
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
@@ -1,98 +1,258 @@
-from typing import Callable, Dict, Any, Awaitable
+import time
+from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, Message, CallbackQuery
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject, Message, CallbackQuery, InlineQuery, ChosenInlineResult, User as TelegramUser
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
-from database import get_db, User
+from database import LazySession, User, async_session_maker, read_session_maker
 from config import Config
+from counters import activity_tracker
+from cache import user_cache, UserSnapshot
+from writer import write_queue
 
 logger = logging.getLogger(__name__)
+# One line per update, sampled by LOG_SAMPLE_RATES ("events")
+event_logger = logging.getLogger("events")
 
+# Events that carry a user and get current_user
+USER_EVENTS = (Message, CallbackQuery, InlineQuery, ChosenInlineResult)
 
-class DatabaseMiddleware(BaseMiddleware):
-    """Middleware to inject database session"""
+
+def snapshot_is_current(snapshot: Optional[UserSnapshot], from_user: TelegramUser) -> bool:
+    """Cached snapshot can be used as is (names unchanged)"""
+    return (
+        snapshot is not None and
+        (snapshot.first_name, snapshot.username) == (from_user.first_name, from_user.username)
+    )
+
+
+async def save_user(session: AsyncSession, from_user: TelegramUser) -> User:
+    """Create user or refresh its profile (write operation)"""
+    result = await session.execute(select(User).where(User.tg_id == from_user.id))
+    user = result.scalar_one_or_none()
     
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        async for session in get_db():
-            data['db'] = session
-            try:
-                return await handler(event, data)
-            except Exception as e:
-                logger.error(f"Error in handler: {e}")
-                await session.rollback()
-                raise
+    if not user:
+        user = User(
+            tg_id=from_user.id,
+            first_name=from_user.first_name,
+            username=from_user.username
+        )
+        session.add(user)
+        await session.flush()
+    else:
+        user.first_name = from_user.first_name
+        user.username = from_user.username
+        # Writing to the bot again means it is not blocked anymore
+        user.is_unreachable = False
+    
+    return user
 
 
-class LoggingMiddleware(BaseMiddleware):
-    """Middleware to log all events"""
+async def load_user(db: AsyncSession, from_user: TelegramUser) -> UserSnapshot:
+    """Load or create user row and cache its snapshot"""
+    result = await db.execute(select(User).where(User.tg_id == from_user.id))
+    user = result.scalar_one_or_none()
     
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        # Log message
-        if isinstance(event, Message):
-            user = event.from_user
-            text = event.text or event.caption or "[Media]"
-            logger.info(
-                f"Message from {user.id} (@{user.username}): {text[:50]}"
-            )
-        
-        # Log callback
-        elif isinstance(event, CallbackQuery):
-            user = event.from_user
-            logger.info(
-                f"Callback from {user.id} (@{user.username}): {event.data}"
-            )
-        
-        return await handler(event, data)
+    if not user:
+        # Handlers need users.id, so wait for the commit
+        user = await write_queue.submit(lambda session: save_user(session, from_user))
+    elif (user.first_name, user.username, user.is_unreachable) != (from_user.first_name, from_user.username, False):
+        write_queue.submit_nowait(lambda session: save_user(session, from_user))
+    
+    snapshot = UserSnapshot(user, is_admin=from_user.id in Config.ADMIN_IDS)
+    snapshot.first_name = from_user.first_name
+    snapshot.username = from_user.username
+    user_cache.set(snapshot)
+    return snapshot
+
+
+class StageTimings:
+    """Per-stage timing counters of the update pipeline"""
+    
+    def __init__(self):
+        # stage -> [count, total seconds, max seconds]
+        self._stages: Dict[str, list] = {}
+    
+    def record(self, stage: str, seconds: float):
+        entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+    
+    def stats(self) -> Dict[str, dict]:
+        return {
+            stage: {
+                'count': count,
+                'avg_ms': round(total / count * 1000, 2),
+                'max_ms': round(longest * 1000, 2)
+            }
+            for stage, (count, total, longest) in self._stages.items()
+        }
+    
+    def reset(self):
+        self._stages.clear()
+
+
+pipeline_timings = StageTimings()
 
 
-class ThrottlingMiddleware(BaseMiddleware):
-    """Middleware to prevent spam"""
+class Throttler:
+    """Per-user rate limit, one instance per event type"""
     
-    def __init__(self, rate_limit: int = 1):
+    def __init__(self, rate_limit: float = 1):
         self.rate_limit = rate_limit
         self.user_timings: Dict[int, float] = {}
     
+    def allow(self, user_id: int) -> bool:
+        current_time = time.time()
+        last_time = self.user_timings.get(user_id, 0)
+        
+        if current_time - last_time < self.rate_limit:
+            return False
+        
+        self.user_timings[user_id] = current_time
+        return True
+
+
+class PipelineMiddleware(BaseMiddleware):
+    """Ordered update pipeline: DB-free rejections first, DB session last
+    
+    Stages: throttle -> cached block check -> logging -> activity ->
+    session + user resolve -> block check -> handler.
+    """
+    
+    def __init__(self, rate_limit: float = 1, timings: StageTimings = pipeline_timings):
+        self.throttler = Throttler(rate_limit)
+        self.timings = timings
+    
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        import time
+        from_user = event.from_user if isinstance(event, USER_EVENTS) else None
+        started = time.perf_counter()
         
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id
+        if from_user is None:
+            return await self._run_with_session(handler, event, data, None, started)
         
-        if user_id:
-            current_time = time.time()
-            last_time = self.user_timings.get(user_id, 0)
-            
-            if current_time - last_time < self.rate_limit:
-                # Too fast, ignore
-                if isinstance(event, CallbackQuery):
-                    await event.answer(
-                        "⏳ Iltimos, biroz kutib turing...",
-                        show_alert=True
-                    )
-                return
-            
-            self.user_timings[user_id] = current_time
+        # 1. Throttling (spam never opens a DB session)
+        if not self.throttler.allow(from_user.id):
+            if isinstance(event, CallbackQuery):
+                await event.answer(
+                    "⏳ Iltimos, biroz kutib turing...",
+                    show_alert=True
+                )
+            self.timings.record('throttled', time.perf_counter() - started)
+            return
         
-        return await handler(event, data)
+        # 2. Block check from cache
+        snapshot = user_cache.get(from_user.id)
+        if snapshot and snapshot.is_blocked:
+            await self._reject_blocked(event)
+            self.timings.record('blocked', time.perf_counter() - started)
+            return
+        
+        # 3. Logging
+        self._log(event)
+        
+        # 4. Activity (written in bulk later)
+        activity_tracker.touch(from_user.id)
+        
+        self.timings.record('precheck', time.perf_counter() - started)
+        return await self._run_with_session(handler, event, data, snapshot, started)
+    
+    async def _run_with_session(self, handler, event, data, snapshot, started) -> Any:
+        from_user = data.get('event_from_user')
+        session_started = time.perf_counter()
+        user_time = handler_time = 0.0
+        
+        try:
+            # Session opens lazily on first DB access, commits only if written.
+            # Only handlers flagged db="write" get the writer's engine, others
+            # read on the read-only one (user rows are written by write_queue)
+            session_maker = async_session_maker if get_flag(data, "db") == "write" else read_session_maker
+            async with LazySession(session_maker) as session:
+                data['db'] = session
+                try:
+                    # 5. User context
+                    if isinstance(event, USER_EVENTS) and from_user:
+                        stage_started = time.perf_counter()
+                        if not snapshot_is_current(snapshot, from_user):
+                            snapshot = await load_user(session, from_user)
+                        data['current_user'] = snapshot
+                        user_time = time.perf_counter() - stage_started
+                        self.timings.record('user', user_time)
+                        
+                        if snapshot.is_blocked:
+                            await self._reject_blocked(event)
+                            return
+                    
+                    # 6. Handler
+                    stage_started = time.perf_counter()
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        handler_time = time.perf_counter() - stage_started
+                        self.timings.record('handler', handler_time)
+                except Exception:
+                    # Failures are never sampled: full event and traceback
+                    logger.exception("Error in handler: %s", self._describe(event))
+                    raise
+        finally:
+            finished = time.perf_counter()
+            session_time = finished - session_started - user_time - handler_time
+            self.timings.record('session', session_time)
+            self.timings.record('total', finished - started)
+            
+            if finished - started >= Config.LOG_SLOW_UPDATE:
+                logger.warning(
+                    "Slow update %.2fs (user %.3fs, handler %.3fs, session %.3fs): %s",
+                    finished - started, user_time, handler_time, session_time, self._describe(event)
+                )
+    
+    @staticmethod
+    def _describe(event: TelegramObject) -> str:
+        user = event.from_user if isinstance(event, USER_EVENTS) else None
+        sender = f"{user.id} (@{user.username})" if user else "unknown"
+        if isinstance(event, Message):
+            text = event.text or event.caption or "[Media]"
+            return f"Message from {sender}: {text[:50]}"
+        if isinstance(event, CallbackQuery):
+            return f"Callback from {sender}: {event.data}"
+        if isinstance(event, InlineQuery):
+            return f"Inline query from {sender}: {event.query[:50]}"
+        return f"{type(event).__name__} from {sender}"
+    
+    @staticmethod
+    def _log(event: TelegramObject):
+        # Lazy %-args: sampled out lines are never formatted
+        user = event.from_user
+        if isinstance(event, Message):
+            text = event.text or event.caption or "[Media]"
+            event_logger.info("Message from %s (@%s): %s", user.id, user.username, text[:50])
+        elif isinstance(event, CallbackQuery):
+            event_logger.info("Callback from %s (@%s): %s", user.id, user.username, event.data)
+        elif isinstance(event, InlineQuery):
+            event_logger.info("Inline query from %s (@%s): %s", user.id, user.username, event.query[:50])
+    
+    @staticmethod
+    async def _reject_blocked(event: TelegramObject):
+        if isinstance(event, Message):
+            await event.answer(
+                "❌ Siz bloklangansiz! Admin bilan bog'laning."
+            )
+        elif isinstance(event, CallbackQuery):
+            await event.answer(
+                "❌ Siz bloklangansiz!",
+                show_alert=True
+            )
+        elif isinstance(event, InlineQuery):
+            await event.answer([], is_personal=True)
 
 
 class AdminCheckMiddleware(BaseMiddleware):
@@ -127,98 +287,17 @@ class AdminCheckMiddleware(BaseMiddleware):
         
         if is_admin_command:
             # Check if user is admin
-            db: AsyncSession = data.get('db')
-            if db:
-                from sqlalchemy import select
-                result = await db.execute(
-                    select(User).where(User.tg_id == user_id)
-                )
-                user = result.scalar_one_or_none()
-                
-                if not user or not user.is_admin:
-                    if isinstance(event, Message):
-                        await event.answer("❌ Sizda admin huquqi yo'q!")
-                    elif isinstance(event, CallbackQuery):
-                        await event.answer(
-                            "❌ Sizda admin huquqi yo'q!",
-                            show_alert=True
-                        )
-                    return
-        
-        return await handler(event, data)
-
-
-class UserActivityMiddleware(BaseMiddleware):
-    """Middleware to track user activity"""
-    
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        # Update user activity
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id
-        
-        if user_id:
-            db: AsyncSession = data.get('db')
-            if db:
-                from sqlalchemy import select
-                from datetime import datetime
-                
-                result = await db.execute(
-                    select(User).where(User.tg_id == user_id)
-                )
-                user = result.scalar_one_or_none()
-                
-                if user:
-                    user.last_active = datetime.utcnow()
-                    await db.commit()
-        
-        return await handler(event, data)
-
-
-class BlockCheckMiddleware(BaseMiddleware):
-    """Middleware to check if user is blocked"""
-    
-    async def __call__(
-        self,
-        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
-        event: TelegramObject,
-        data: Dict[str, Any]
-    ) -> Any:
-        # Get user ID
-        user_id = None
-        if isinstance(event, Message):
-            user_id = event.from_user.id
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id
-        
-        if user_id:
-            db: AsyncSession = data.get('db')
-            if db:
-                from sqlalchemy import select
-                
-                result = await db.execute(
-                    select(User).where(User.tg_id == user_id)
-                )
-                user = result.scalar_one_or_none()
-                
-                if user and user.is_blocked:
-                    if isinstance(event, Message):
-                        await event.answer(
-                            "❌ Siz bloklangansiz! Admin bilan bog'laning."
-                        )
-                    elif isinstance(event, CallbackQuery):
-                        await event.answer(
-                            "❌ Siz bloklangansiz!",
-                            show_alert=True
-                        )
-                    return
+            user: UserSnapshot = data.get('current_user')
+            
+            if not user or not user.is_admin:
+                if isinstance(event, Message):
+                    await event.answer("❌ Sizda admin huquqi yo'q!")
+                elif isinstance(event, CallbackQuery):
+                    await event.answer(
+                        "❌ Sizda admin huquqi yo'q!",
+                        show_alert=True
+                    )
+                return
         
         return await handler(event, data)
 
@@ -226,24 +305,11 @@ class BlockCheckMiddleware(BaseMiddleware):
 def setup_middlewares(dp):
     """Setup all middlewares"""
     
-    # Database middleware (must be first)
-    dp.message.middleware(DatabaseMiddleware())
-    dp.callback_query.middleware(DatabaseMiddleware())
-    
-    # Logging middleware
-    dp.message.middleware(LoggingMiddleware())
-    dp.callback_query.middleware(LoggingMiddleware())
-    
-    # Block check
-    dp.message.middleware(BlockCheckMiddleware())
-    dp.callback_query.middleware(BlockCheckMiddleware())
-    
-    # Throttling
-    dp.message.middleware(ThrottlingMiddleware(rate_limit=1))
-    dp.callback_query.middleware(ThrottlingMiddleware(rate_limit=0.5))
-    
-    # User activity tracking
-    dp.message.middleware(UserActivityMiddleware())
-    dp.callback_query.middleware(UserActivityMiddleware())
+    # One ordered pipeline per event type (separate throttling limits)
+    dp.message.middleware(PipelineMiddleware(rate_limit=1))
+    dp.callback_query.middleware(PipelineMiddleware(rate_limit=0.5))
+    # Clients already debounce typing, every inline query needs an answer
+    dp.inline_query.middleware(PipelineMiddleware(rate_limit=0))
+    dp.chosen_inline_result.middleware(PipelineMiddleware(rate_limit=0))
     
-    logger.info("✅ Middlewares registered successfully!")
\ No newline at end of file
+    logger.info("✅ Middlewares registered successfully!")
@@ -0,0 +1,170 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import read_session_maker, User, Movie, Rating, Stats
+from counters import PeriodicFlusher, view_counter, activity_tracker
+from writer import write_queue
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# stats_type -> window in calendar days (today included)
+ROLLUP_WINDOWS = {"daily": 1, "weekly": 7, "monthly": 30}
+
+NEW_FIELDS = ("new_users", "new_movies", "new_ratings")
+
+
+def day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class StatsRollup(PeriodicFlusher):
+    """Keeps the stats table up to date
+
+    One "daily" row per calendar day, plus "weekly" / "monthly" rows for
+    today summed from the daily rows. A run only counts rows created since
+    yesterday (indexed range queries), missing days are backfilled.
+    """
+
+    def __init__(self, flush_interval: float = 300, backfill_days: int = 30):
+        super().__init__(flush_interval)
+        self.backfill_days = backfill_days
+
+    def start(self):
+        super().start()
+        # First rollup right after startup
+        self._wakeup.set()
+
+    async def flush(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Stats rollup failed: {e}")
+
+    async def _count_new(self, session: AsyncSession, start: datetime, end: datetime) -> Dict[str, int]:
+        users = await session.execute(
+            select(func.count(User.id)).where(User.joined_at >= start, User.joined_at < end)
+        )
+        movies = await session.execute(
+            select(func.count(Movie.id)).where(Movie.created_at >= start, Movie.created_at < end)
+        )
+        ratings = await session.execute(
+            select(func.count(Rating.id)).where(Rating.created_at >= start, Rating.created_at < end)
+        )
+        return {
+            'new_users': users.scalar(),
+            'new_movies': movies.scalar(),
+            'new_ratings': ratings.scalar()
+        }
+
+    async def refresh(self):
+        """Recompute today's rollups (and days not rolled up yet)"""
+        # Pending counters first so totals are exact
+        await view_counter.flush()
+        await activity_tracker.flush()
+
+        now = datetime.utcnow()
+        today = day_start(now)
+        oldest = today - timedelta(days=self.backfill_days - 1)
+        window_start = today - timedelta(days=max(ROLLUP_WINDOWS.values()) - 1)
+
+        async with read_session_maker() as session:
+            result = await session.execute(
+                select(func.max(Stats.date)).where(Stats.stats_type == "daily")
+            )
+            last_day = result.scalar()
+
+            # Yesterday is recounted once more: rows may have arrived after its last run
+            first_day = max(oldest, min(last_day, today - timedelta(days=1))) if last_day else oldest
+
+            days = {}
+            day = first_day
+            while day <= today:
+                days[day] = await self._count_new(session, day, day + timedelta(days=1))
+                day += timedelta(days=1)
+
+            result = await session.execute(
+                select(Stats.date, Stats.new_users, Stats.new_movies, Stats.new_ratings).where(
+                    Stats.stats_type == "daily",
+                    Stats.date >= window_start,
+                    Stats.date < first_day
+                )
+            )
+            history = {
+                row.date: {field: getattr(row, field) or 0 for field in NEW_FIELDS}
+                for row in result.all()
+            }
+            history.update(days)
+
+            totals = {
+                'total_users': (await session.execute(select(func.count(User.id)))).scalar(),
+                'total_movies': (await session.execute(select(func.count(Movie.id)))).scalar(),
+                'total_views': (await session.execute(select(func.sum(Movie.views)))).scalar() or 0,
+                'total_ratings': (await session.execute(select(func.count(Rating.id)))).scalar(),
+                'unreachable_users': (await session.execute(
+                    select(func.count(User.id)).where(User.is_unreachable == True)
+                )).scalar()
+            }
+
+            active = {}
+            for stats_type, window in ROLLUP_WINDOWS.items():
+                result = await session.execute(
+                    select(func.count(User.id)).where(
+                        User.last_active >= today - timedelta(days=window - 1)
+                    )
+                )
+                active[stats_type] = result.scalar()
+
+        rows = [("daily", day, values) for day, values in days.items() if day != today]
+        for stats_type, window in ROLLUP_WINDOWS.items():
+            since = today - timedelta(days=window - 1)
+            values = {
+                field: sum(counts[field] for day, counts in history.items() if day >= since)
+                for field in NEW_FIELDS
+            }
+            values.update(totals, active_users=active[stats_type])
+            rows.append((stats_type, today, values))
+
+        async def write(session):
+            result = await session.execute(select(Stats).where(Stats.date >= first_day))
+            existing = {(row.stats_type, row.date): row for row in result.scalars()}
+
+            for stats_type, date, values in rows:
+                row = existing.get((stats_type, date))
+                if row is None:
+                    row = Stats(stats_type=stats_type, date=date)
+                    session.add(row)
+                for field, value in values.items():
+                    setattr(row, field, value)
+                row.updated_at = now
+
+        await write_queue.submit(write)
+
+
+async def _latest_rollup(db: AsyncSession, stats_type: str) -> Optional[Stats]:
+    result = await db.execute(
+        select(Stats)
+        .where(Stats.stats_type == stats_type)
+        .order_by(Stats.date.desc())
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def get_rollup(db: AsyncSession, stats_type: str = "daily") -> Optional[Stats]:
+    """Latest rollup row of a type (one indexed read)"""
+    stats = await _latest_rollup(db, stats_type)
+
+    if stats is None:
+        # Nothing rolled up yet (first start)
+        await stats_rollup.refresh()
+        stats = await _latest_rollup(db, stats_type)
+
+    return stats
+
+
+stats_rollup = StatsRollup(flush_interval=Config.STATS_ROLLUP_INTERVAL)
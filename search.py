@@ -0,0 +1,94 @@
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Movie, is_sqlite
+from cache import inline_query_cache
+from catalog import movie_catalog, CatalogEntry
+from leaderboard import movie_leaderboard
+
+# Words of a search query (split like the unicode61 tokenizer)
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+FTS_SEARCH_SQL = text("""
+    SELECT m.id, m.code, m.title, m.views
+    FROM movies_fts
+    JOIN movies AS m ON m.id = movies_fts.rowid
+    WHERE movies_fts MATCH :query AND m.is_active = 1
+    ORDER BY movies_fts.rank
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def fts_query(query: str) -> str:
+    """User input -> FTS5 query: every word must match, as a prefix"""
+    words = WORD_RE.findall(query.lower())
+    return " ".join(f'"{word}"*' for word in words)
+
+
+async def _search_rows(db: AsyncSession, query: str, offset: int, limit: int):
+    """Ranked active movies matching title/description (id, code, title, views)"""
+    if is_sqlite():
+        match = fts_query(query)
+        if not match:
+            return []
+        result = await db.execute(FTS_SEARCH_SQL, {'query': match, 'limit': limit, 'offset': offset})
+    else:
+        # Server databases: plain title search
+        result = await db.execute(
+            select(Movie.id, Movie.code, Movie.title, Movie.views)
+            .where(Movie.is_active == True, Movie.title.ilike(f"%{query}%"))
+            .order_by(Movie.views.desc(), Movie.id)
+            .limit(limit)
+            .offset(offset)
+        )
+    return result.all()
+
+
+async def search_movies(db: AsyncSession, query: str, page: int = 1, per_page: int = 10) -> Tuple[List[dict], bool]:
+    """Ranked active movies matching title/description, and whether a next page exists"""
+    rows = await _search_rows(db, query, (page - 1) * per_page, per_page + 1)
+    movies = [
+        {'id': row.id, 'code': row.code, 'title': row.title, 'views': row.views}
+        for row in rows[:per_page]
+    ]
+    return movies, len(rows) > per_page
+
+
+async def _inline_movie_ids(db: AsyncSession, query: str, offset: int, limit: int) -> Tuple[List[int], Optional[int]]:
+    if not query:
+        # Empty query: most watched movies
+        ids = [movie_id for movie_id, _ in movie_leaderboard.top(movie_leaderboard.capacity)]
+        page = ids[offset:offset + limit]
+        return page, offset + limit if offset + limit < len(ids) else None
+
+    rows = await _search_rows(db, query, offset, limit + 1)
+    ids = [row.id for row in rows[:limit]]
+
+    # Exact code goes first
+    entry = movie_catalog.get(query) if offset == 0 else None
+    if entry:
+        ids = [entry.id] + [movie_id for movie_id in ids if movie_id != entry.id]
+
+    return ids, offset + limit if len(rows) > limit else None
+
+
+async def inline_search(db: AsyncSession, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[CatalogEntry], Optional[int]]:
+    """Movies for an inline query page by code or title, and the next offset
+
+    Pages are cached as movie ids and resolved through the catalog, so
+    deleted movies drop out and counters are current.
+    """
+    query = " ".join(query.lower().split())
+    key = (query, offset, limit)
+
+    cached = inline_query_cache.get(key)
+    if cached is None:
+        cached = await _inline_movie_ids(db, query, offset, limit)
+        inline_query_cache.set(key, cached)
+
+    ids, next_offset = cached
+    movies = [movie_catalog.get_by_id(movie_id) for movie_id in ids]
+    return [movie for movie in movies if movie], next_offset
@@ -0,0 +1,135 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import select, delete
+
+from database import read_session_maker, FSMRecord
+from cache import QueryCache
+from counters import PeriodicFlusher
+from writer import write_queue
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """FSM storage in the fsm_states table, shared by all bot processes
+
+    Writes go through the single writer and push the expiry forward, a
+    conversation untouched for `state_ttl` seconds reads as empty. Reads
+    are cached in process for `cache_ttl` seconds, which is safe while one
+    user's updates are handled by one process.
+    """
+
+    def __init__(self, state_ttl: float = 86400, cache_ttl: float = 60, cache_size: int = 10000):
+        self.state_ttl = state_ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = QueryCache(ttl=cache_ttl, max_size=cache_size)
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        async with read_session_maker() as session:
+            result = await session.execute(
+                select(FSMRecord.state, FSMRecord.data, FSMRecord.expires_at).where(FSMRecord.key == key)
+            )
+            row = result.first()
+
+        if row is None or (row.expires_at and row.expires_at <= datetime.utcnow()):
+            record = (None, {})
+        else:
+            record = (row.state, json.loads(row.data) if row.data else {})
+
+        self._cache.set(key, record)
+        return record
+
+    async def _save(self, key: str, **values):
+        now = datetime.utcnow()
+
+        async def write(session):
+            row = await session.get(FSMRecord, key)
+            created = row is None
+            if created:
+                row = FSMRecord(key=key)
+            elif row.expires_at and row.expires_at <= now:
+                # Expired conversation starts empty
+                row.state = None
+                row.data = None
+
+            for field, value in values.items():
+                setattr(row, field, value)
+
+            if row.state is None and not json.loads(row.data or "{}"):
+                # Nothing left to keep
+                if not created:
+                    await session.delete(row)
+                return None, {}
+
+            if created:
+                session.add(row)
+            row.updated_at = now
+            row.expires_at = now + timedelta(seconds=self.state_ttl)
+            return row.state, json.loads(row.data or "{}")
+
+        try:
+            record = await write_queue.submit(write)
+        except Exception:
+            self._cache.invalidate(key)
+            raise
+        self._cache.set(key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._save(self.key_builder.build(key), state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._save(self.key_builder.build(key), data=json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return dict(data)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    async def close(self) -> None:
+        # Engine is disposed by close_db()
+        pass
+
+
+class FSMCleaner(PeriodicFlusher):
+    """Deletes expired conversations from fsm_states"""
+
+    async def flush(self):
+        now = datetime.utcnow()
+
+        async def write(session):
+            result = await session.execute(delete(FSMRecord).where(FSMRecord.expires_at <= now))
+            return result.rowcount
+
+        try:
+            removed = await write_queue.submit(write)
+        except Exception as e:
+            logger.error(f"FSM cleanup failed: {e}")
+            return
+
+        if removed:
+            logger.info(f"🧹 Expired FSM states removed: {removed}")
+
+
+fsm_storage = SQLAlchemyStorage(
+    state_ttl=Config.FSM_STATE_TTL,
+    cache_ttl=Config.FSM_CACHE_TTL,
+    cache_size=Config.FSM_CACHE_SIZE
+)
+fsm_cleaner = FSMCleaner(flush_interval=Config.FSM_CLEANUP_INTERVAL)
@@ -1,20 +1,75 @@
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
+from aiogram.types import (
+    Message, CallbackQuery, ChatMemberUpdated, InlineQuery, ChosenInlineResult,
+    InlineQueryResultCachedVideo, InlineQueryResultsButton
+)
 from aiogram.filters import Command, ChatMemberUpdatedFilter, KICKED, MEMBER, ADMINISTRATOR
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+import asyncio
+import logging
 
 from database import User, Movie, Channel, Rating, Subscription
 from user_keyboard import *
+from cache import subscription_cache, UserSnapshot
+from catalog import movie_catalog, CatalogEntry
+from counters import view_counter
+from leaderboard import movie_leaderboard
+from broadcast import mark_unreachable
+from writer import write_queue
+from search import inline_search
+from config import Config
+
+logger = logging.getLogger(__name__)
 
 
 router = Router()
 
 
+# Limits concurrent get_chat_member calls across all requests
+subscription_semaphore = asyncio.Semaphore(Config.SUBSCRIPTION_CHECK_CONCURRENCY)
+
+
+def channel_info(channel: Channel) -> dict:
+    return {
+        'id': channel.channel_id,
+        'title': channel.title,
+        'username': channel.username,
+        'invite_link': channel.invite_link
+    }
+
+
+# Check membership in one channel via Bot API
+async def check_channel_membership(bot: Bot, user_id: int, channel_id: int) -> bool:
+    async with subscription_semaphore:
+        try:
+            member = await asyncio.wait_for(
+                bot.get_chat_member(channel_id, user_id),
+                timeout=Config.SUBSCRIPTION_CHECK_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"get_chat_member timed out: user={user_id} channel={channel_id}")
+            # Timeouts are not cached, policy decides the answer
+            return Config.SUBSCRIPTION_FAIL_OPEN
+        except Exception:
+            # API errors are not cached, next request retries
+            return False
+    
+    is_member = member.status in ['member', 'administrator', 'creator']
+    subscription_cache.set(user_id, channel_id, is_member)
+    return is_member
+
+
 # Check subscription to mandatory channels
-async def check_user_subscriptions(bot: Bot, user_id: int, db: AsyncSession) -> tuple[bool, list]:
+async def check_user_subscriptions(
+    bot: Bot,
+    user_id: int,
+    db: AsyncSession,
+    force_refresh: bool = False,
+    stop_on_first_failure: bool = Config.SUBSCRIPTION_STOP_ON_FIRST_FAILURE
+) -> tuple[bool, list]:
     result = await db.execute(
         select(Channel).where(
             and_(Channel.channel_type == "mandatory", Channel.is_active == True)
@@ -22,58 +77,39 @@ async def check_user_subscriptions(bot: Bot, user_id: int, db: AsyncSession) ->
     )
     channels = result.scalars().all()
     
-    not_subscribed = []
+    failed = set()
+    tasks = {}
     
     for channel in channels:
-        try:
-            member = await bot.get_chat_member(channel.channel_id, user_id)
-            if member.status not in ['member', 'administrator', 'creator']:
-                not_subscribed.append({
-                    'id': channel.channel_id,
-                    'title': channel.title,
-                    'username': channel.username,
-                    'invite_link': channel.invite_link
-                })
-        except Exception:
-            not_subscribed.append({
-                'id': channel.channel_id,
-                'title': channel.title,
-                'username': channel.username,
-                'invite_link': channel.invite_link
-            })
+        is_member = None if force_refresh else subscription_cache.get(user_id, channel.channel_id)
+        
+        if is_member is None:
+            task = asyncio.create_task(check_channel_membership(bot, user_id, channel.channel_id))
+            tasks[task] = channel.channel_id
+        elif not is_member:
+            failed.add(channel.channel_id)
+    
+    pending = set(tasks)
+    while pending and not (stop_on_first_failure and failed):
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.result():
+                failed.add(tasks[task])
+    
+    # Early exit: channels left unverified are shown to the user as well
+    for task in pending:
+        task.cancel()
+        failed.add(tasks[task])
+    
+    not_subscribed = [channel_info(channel) for channel in channels if channel.channel_id in failed]
     
     return len(not_subscribed) == 0, not_subscribed
 
 
-# Get or create user
-async def get_or_create_user(message: Message, db: AsyncSession) -> User:
-    result = await db.execute(select(User).where(User.tg_id == message.from_user.id))
-    user = result.scalar_one_or_none()
-    
-    if not user:
-        user = User(
-            tg_id=message.from_user.id,
-            first_name=message.from_user.first_name,
-            username=message.from_user.username
-        )
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-    else:
-        user.last_active = datetime.utcnow()
-        user.first_name = message.from_user.first_name
-        user.username = message.from_user.username
-        await db.commit()
-    
-    return user
-
-
 # Start command
 @router.message(Command("start"))
-async def start_handler(message: Message, db: AsyncSession):
-    user = await get_or_create_user(message, db)
-    
-    if user.is_blocked:
+async def start_handler(message: Message, db: AsyncSession, current_user: UserSnapshot):
+    if current_user.is_blocked:
         await message.answer("❌ Siz bloklangansiz! Admin bilan bog'laning.  📞 @rizo3313")
         return
     
@@ -110,13 +146,25 @@ admin bilan bog'laning: @rizo3313
     await message.answer(text, reply_markup=user_main_menu(), parse_mode="HTML")
 
 
+# User blocked / unblocked the bot
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def bot_blocked_by_user(event: ChatMemberUpdated):
+    mark_unreachable([event.from_user.id])
+
+
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def bot_unblocked_by_user(event: ChatMemberUpdated):
+    mark_unreachable([event.from_user.id], unreachable=False)
+
+
 # Check subscription callback
 @router.callback_query(F.data == "check_subscription")
 async def check_subscription_callback(callback: CallbackQuery, db: AsyncSession):
     is_subscribed, channels = await check_user_subscriptions(
         callback.bot, 
         callback.from_user.id, 
-        db
+        db,
+        force_refresh=True
     )
     
     if not is_subscribed:
@@ -142,15 +190,46 @@ admin bilan bog'laning: @rizo3313
     await callback.answer()
 
 
+def movie_caption(movie: CatalogEntry) -> str:
+    return f"""
+🎬 <b>{movie.title}</b>
+
+{movie.description or ""}
+
+🔢 Kod: <code>{movie.code}</code>
+👁 Ko'rilgan: {movie.views} marta
+⭐️ Rating: {movie.likes} 👍 / {movie.dislikes} 👎
+
+@Kinamax_bot orqali
+    """
+
+
+def count_view(movie: CatalogEntry, user_id: int):
+    """Update stats of a delivered movie (written to DB in batches)"""
+    view_counter.record_view(movie.id, user_id)
+    movie.views += 1
+    movie_leaderboard.offer(movie.id, movie.views)
+
+
 # Movie search by code
 @router.message(F.text.regexp(r'^\d{4}$'))
-async def search_movie_by_code(message: Message, db: AsyncSession):
-    user = await get_or_create_user(message, db)
-    
-    if user.is_blocked:
+async def search_movie_by_code(message: Message, db: AsyncSession, current_user: UserSnapshot):
+    if current_user.is_blocked:
         await message.answer("❌ Siz bloklangansiz!")
         return
     
+    code = message.text.strip()
+    
+    # Search movie (in-memory catalog, misses never reach DB or Bot API)
+    movie = movie_catalog.get(code)
+    
+    if not movie:
+        await message.answer(
+            "❌ Bunday kodli kino topilmadi!\n\n"
+            "Iltimos, to'g'ri kodni kiriting yoki admin bilan bog'laning."
+        )
+        return
+    
     # Check subscriptions
     is_subscribed, channels = await check_user_subscriptions(message.bot, message.from_user.id, db)
     
@@ -162,50 +241,20 @@ async def search_movie_by_code(message: Message, db: AsyncSession):
         )
         return
     
-    code = message.text.strip()
-    
-    # Search movie
-    result = await db.execute(
-        select(Movie).where(and_(Movie.code == code, Movie.is_active == True))
-    )
-    movie = result.scalar_one_or_none()
-    
-    if not movie:
-        await message.answer(
-            "❌ Bunday kodli kino topilmadi!\n\n"
-            "Iltimos, to'g'ri kodni kiriting yoki admin bilan bog'laning."
-        )
-        return
-    
     # Send loading animation
     loading_msg = await message.answer("🎬 Kino yuklanmoqda...")
     
     # Send movie
-    caption = f"""
-🎬 <b>{movie.title}</b>
-
-{movie.description or ""}
-
-🔢 Kod: <code>{movie.code}</code>
-👁 Ko'rilgan: {movie.views} marta
-⭐️ Rating: {movie.likes} 👍 / {movie.dislikes} 👎
-
-@Kinamax_bot orqali
-    """
-    
     try:
         await message.bot.send_video(
             chat_id=message.chat.id,
             video=movie.file_id,
-            caption=caption,
+            caption=movie_caption(movie),
             parse_mode="HTML",
             reply_markup=movie_rating_keyboard(movie.id)
         )
         
-        # Update stats
-        movie.views += 1
-        user.watched_movies += 1
-        await db.commit()
+        count_view(movie, current_user.id)
         
         await loading_msg.delete()
         
@@ -213,138 +262,143 @@ async def search_movie_by_code(message: Message, db: AsyncSession):
         await loading_msg.edit_text("❌ Kino yuborishda xatolik yuz berdi!")
 
 
-# Movie rating - Like
-@router.callback_query(F.data.startswith("rate_like_"))
-async def rate_movie_like(callback: CallbackQuery, db: AsyncSession):
-    movie_id = int(callback.data.split("_")[-1])
+# Inline mode: @Kinamax_bot <title or code>
+@router.inline_query()
+async def inline_movie_search(inline_query: InlineQuery, db: AsyncSession):
+    is_subscribed, _ = await check_user_subscriptions(inline_query.bot, inline_query.from_user.id, db)
     
-    # Check if already rated
-    result = await db.execute(
-        select(Rating).where(
-            and_(Rating.movie_id == movie_id, Rating.user_id == callback.from_user.id)
+    if not is_subscribed:
+        await inline_query.answer(
+            [],
+            is_personal=True,
+            cache_time=0,
+            button=InlineQueryResultsButton(text="📢 Kanallarga obuna bo'ling", start_parameter="subscribe")
         )
-    )
-    existing_rating = result.scalar_one_or_none()
-    
-    if existing_rating:
-        await callback.answer("✅ Siz bu kinoni allaqachon baholagansiz!", show_alert=True)
         return
     
-    # Get movie
-    movie_result = await db.execute(select(Movie).where(Movie.id == movie_id))
-    movie = movie_result.scalar_one_or_none()
-    
-    if not movie:
-        await callback.answer("❌ Kino topilmadi!", show_alert=True)
-        return
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    movies, next_offset = await inline_search(
+        db, inline_query.query, offset, Config.INLINE_RESULTS_PER_PAGE
+    )
     
-    # Get user
-    user_result = await db.execute(select(User).where(User.tg_id == callback.from_user.id))
-    user = user_result.scalar_one_or_none()
+    results = [
+        InlineQueryResultCachedVideo(
+            id=str(movie.id),
+            video_file_id=movie.file_id,
+            title=movie.title,
+            description=f"🔢 {movie.code} | 👁 {movie.views}",
+            caption=movie_caption(movie),
+            parse_mode="HTML",
+            reply_markup=movie_rating_keyboard(movie.id)
+        )
+        for movie in movies
+    ]
+    
+    # Personal: answers depend on the user's subscriptions
+    await inline_query.answer(
+        results,
+        is_personal=True,
+        cache_time=Config.INLINE_CACHE_TIME,
+        next_offset=str(next_offset) if next_offset is not None else ""
+    )
+
+
+# Inline result sent (needs inline feedback enabled in @BotFather)
+@router.chosen_inline_result()
+async def inline_movie_chosen(chosen: ChosenInlineResult, current_user: UserSnapshot):
+    movie = movie_catalog.get_by_id(int(chosen.result_id)) if chosen.result_id.isdigit() else None
+    if movie:
+        count_view(movie, current_user.id)
+
+
+async def save_rating(session: AsyncSession, user_id: int, movie_id: int, rating_type: str, stars: int = None):
+    """Store rating and update counters (write operation)
     
-    # Add rating
-    rating = Rating(
-        user_id=user.id,
-        movie_id=movie_id,
-        rating_type="like"
+    Returns (likes, dislikes) of the movie, or None if already rated.
+    Runs in the single writer, so the duplicate check cannot race.
+    """
+    result = await session.execute(
+        select(Rating.id).where(
+            and_(Rating.movie_id == movie_id, Rating.user_id == user_id)
+        )
     )
-    db.add(rating)
+    if result.first():
+        return None
+    
+    session.add(Rating(user_id=user_id, movie_id=movie_id, rating_type=rating_type, stars=stars))
     
-    movie.likes += 1
-    user.total_ratings += 1
+    if rating_type == "like":
+        await session.execute(update(Movie).where(Movie.id == movie_id).values(likes=Movie.likes + 1))
+    elif rating_type == "dislike":
+        await session.execute(update(Movie).where(Movie.id == movie_id).values(dislikes=Movie.dislikes + 1))
     
-    await db.commit()
+    await session.execute(
+        update(User).where(User.id == user_id).values(total_ratings=User.total_ratings + 1)
+    )
     
-    await callback.message.edit_reply_markup(reply_markup=rating_thanks_keyboard())
-    await callback.answer("✅ Rahmat! Sizga yoqqanidan xursandmiz! 👍", show_alert=True)
+    result = await session.execute(select(Movie.likes, Movie.dislikes).where(Movie.id == movie_id))
+    return tuple(result.one())
 
 
-# Movie rating - Dislike
-@router.callback_query(F.data.startswith("rate_dislike_"))
-async def rate_movie_dislike(callback: CallbackQuery, db: AsyncSession):
-    movie_id = int(callback.data.split("_")[-1])
+async def rate_movie(callback: CallbackQuery, current_user: UserSnapshot, movie_id: int, rating_type: str, stars: int = None) -> bool:
+    """Save rating through the writer, answers the callback on failure"""
+    entry = movie_catalog.get_by_id(movie_id)
     
-    # Check if already rated
-    result = await db.execute(
-        select(Rating).where(
-            and_(Rating.movie_id == movie_id, Rating.user_id == callback.from_user.id)
-        )
+    if not entry:
+        await callback.answer("❌ Kino topilmadi!", show_alert=True)
+        return False
+    
+    counts = await write_queue.submit(
+        lambda session: save_rating(session, current_user.id, movie_id, rating_type, stars)
     )
-    existing_rating = result.scalar_one_or_none()
     
-    if existing_rating:
+    if counts is None:
         await callback.answer("✅ Siz bu kinoni allaqachon baholagansiz!", show_alert=True)
-        return
+        return False
     
-    # Get movie
-    movie_result = await db.execute(select(Movie).where(Movie.id == movie_id))
-    movie = movie_result.scalar_one_or_none()
+    entry.likes, entry.dislikes = counts
     
-    # Get user
-    user_result = await db.execute(select(User).where(User.tg_id == callback.from_user.id))
-    user = user_result.scalar_one_or_none()
-    
-    # Add rating
-    rating = Rating(
-        user_id=user.id,
-        movie_id=movie_id,
-        rating_type="dislike"
-    )
-    db.add(rating)
-    
-    movie.dislikes += 1
-    user.total_ratings += 1
+    if callback.message:
+        await callback.message.edit_reply_markup(reply_markup=rating_thanks_keyboard())
+    else:
+        # Sent via inline mode: menu buttons need a bot chat, just drop the keyboard
+        await callback.bot.edit_message_reply_markup(inline_message_id=callback.inline_message_id)
+    return True
+
+
+# Movie rating - Like
+@router.callback_query(F.data.startswith("rate_like_"))
+async def rate_movie_like(callback: CallbackQuery, current_user: UserSnapshot):
+    movie_id = int(callback.data.split("_")[-1])
     
-    await db.commit()
+    if await rate_movie(callback, current_user, movie_id, "like"):
+        await callback.answer("✅ Rahmat! Sizga yoqqanidan xursandmiz! 👍", show_alert=True)
+
+
+# Movie rating - Dislike
+@router.callback_query(F.data.startswith("rate_dislike_"))
+async def rate_movie_dislike(callback: CallbackQuery, current_user: UserSnapshot):
+    movie_id = int(callback.data.split("_")[-1])
     
-    await callback.message.edit_reply_markup(reply_markup=rating_thanks_keyboard())
-    await callback.answer("Fikringiz uchun rahmat! 👎", show_alert=True)
+    if await rate_movie(callback, current_user, movie_id, "dislike"):
+        await callback.answer("Fikringiz uchun rahmat! 👎", show_alert=True)
 
 
 # Star rating
 @router.callback_query(F.data.startswith("star_"))
-async def rate_movie_stars(callback: CallbackQuery, db: AsyncSession):
+async def rate_movie_stars(callback: CallbackQuery, current_user: UserSnapshot):
     parts = callback.data.split("_")
     stars = int(parts[1])
     movie_id = int(parts[2])
     
-    # Check if already rated
-    result = await db.execute(
-        select(Rating).where(
-            and_(Rating.movie_id == movie_id, Rating.user_id == callback.from_user.id)
-        )
-    )
-    existing_rating = result.scalar_one_or_none()
-    
-    if existing_rating:
-        await callback.answer("✅ Siz bu kinoni allaqachon baholagansiz!", show_alert=True)
-        return
-    
-    # Get user
-    user_result = await db.execute(select(User).where(User.tg_id == callback.from_user.id))
-    user = user_result.scalar_one_or_none()
-    
-    # Add rating
-    rating = Rating(
-        user_id=user.id,
-        movie_id=movie_id,
-        rating_type="stars",
-        stars=stars
-    )
-    db.add(rating)
-    
-    user.total_ratings += 1
-    await db.commit()
-    
-    await callback.message.edit_reply_markup(reply_markup=rating_thanks_keyboard())
-    await callback.answer(f"✅ {stars} ⭐️ baho berildi! Rahmat!", show_alert=True)
+    if await rate_movie(callback, current_user, movie_id, "stars", stars):
+        await callback.answer(f"✅ {stars} ⭐️ baho berildi! Rahmat!", show_alert=True)
 
 
 # User profile
 @router.message(F.text == "👤 Profil")
-async def user_profile(message: Message, db: AsyncSession):
-    result = await db.execute(select(User).where(User.tg_id == message.from_user.id))
-    user = result.scalar_one_or_none()
+async def user_profile(message: Message, db: AsyncSession, current_user: UserSnapshot):
+    user = await db.get(User, current_user.id)
     
     if not user:
         await message.answer("❌ Xatolik yuz berdi!")
@@ -358,7 +412,7 @@ async def user_profile(message: Message, db: AsyncSession):
 📅 Qo'shilgan: {user.joined_at.strftime('%d.%m.%Y')}
 
 📊 STATISTIKA:
-🎬 Ko'rilgan kinolar: {user.watched_movies} ta
+🎬 Ko'rilgan kinolar: {user.watched_movies + view_counter.pending_user_watches(user.id)} ta
 ⭐️ Baholangan kinolar: {user.total_ratings} ta
     """
     
@@ -375,6 +429,9 @@ async def help_command(message: Message):
 Bot yoki kanallarda e'lon qilingan 4-xonali kodni yuboring.
 Misol: <code>1234</code>
 
+🔎 <b>Istalgan chatda:</b>
+<code>@Kinamax_bot</code> dan keyin kino nomi yoki kodini yozing.
+
 ⭐️ <b>Baholash:</b>
 Kino ko'rgandan so'ng "👍 Yoqdi" yoki "👎 Yoqmadi" tugmasini bosing.
 
@@ -1,7 +1,10 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
+from markups import prebuilt, cached
+
 
 # User main menu
+@prebuilt
 def user_main_menu() -> ReplyKeyboardMarkup:
     keyboard = [
         [KeyboardButton(text="ℹ️ Yordam"), KeyboardButton(text="👤 Profil")],
@@ -10,6 +13,7 @@ def user_main_menu() -> ReplyKeyboardMarkup:
 
 
 # Movie rating keyboard
+@cached
 def movie_rating_keyboard(movie_id: int) -> InlineKeyboardMarkup:
     keyboard = [
         [
@@ -55,6 +59,7 @@ def subscription_check_keyboard(channels: list) -> InlineKeyboardMarkup:
 
 
 # User profile menu
+@prebuilt
 def user_profile_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🎬 Ko'rilgan kinolar", callback_data="my_movies")],
@@ -66,6 +71,7 @@ def user_profile_menu() -> InlineKeyboardMarkup:
 
 
 # Help menu
+@prebuilt
 def help_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="📝 Qo'llanma", callback_data="help_guide")],
@@ -77,6 +83,7 @@ def help_menu() -> InlineKeyboardMarkup:
 
 
 # Share movie keyboard
+@cached
 def share_movie_keyboard(movie_code: str) -> InlineKeyboardMarkup:
     share_text = f"Bu kinoni tomosha qiling! Kod: {movie_code}"
     share_url = f"https://t.me/share/url?url={share_text}"
@@ -89,6 +96,7 @@ def share_movie_keyboard(movie_code: str) -> InlineKeyboardMarkup:
 
 
 # Movie info keyboard
+@cached
 def movie_info_keyboard(movie_id: int, movie_code: str) -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="⭐️ Baholash", callback_data=f"open_rating_{movie_id}")],
@@ -99,6 +107,7 @@ def movie_info_keyboard(movie_id: int, movie_code: str) -> InlineKeyboardMarkup:
 
 
 # Back to main button
+@prebuilt
 def back_to_main_button() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🔙 Asosiy menyu", callback_data="back_to_main")]
@@ -107,6 +116,7 @@ def back_to_main_button() -> InlineKeyboardMarkup:
 
 
 # Rating thank you keyboard
+@prebuilt
 def rating_thanks_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="🔍 Yana kino qidirish", callback_data="search_again")],
@@ -116,7 +126,7 @@ def rating_thanks_keyboard() -> InlineKeyboardMarkup:
 
 
 # Movie search results
-def movie_search_results(movies: list) -> InlineKeyboardMarkup:
+def movie_search_results(movies: list, page: int = 1, has_next: bool = False, back: str = "back_to_main") -> InlineKeyboardMarkup:
     keyboard = []
     
     for movie in movies:
@@ -125,12 +135,21 @@ def movie_search_results(movies: list) -> InlineKeyboardMarkup:
             callback_data=f"get_movie_{movie['code']}"
         )])
     
-    keyboard.append([InlineKeyboardButton(text="🔙 Ortga", callback_data="back_to_main")])
+    nav_buttons = []
+    if page > 1:
+        nav_buttons.append(InlineKeyboardButton(text="◀️ Oldingi", callback_data=f"msearch_page_{page-1}"))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton(text="Keyingi ▶️", callback_data=f"msearch_page_{page+1}"))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+    
+    keyboard.append([InlineKeyboardButton(text="🔙 Ortga", callback_data=back)])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
 # Close button
+@prebuilt
 def close_button() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton(text="❌ Yopish", callback_data="close")]
@@ -1,11 +1,13 @@
-import random
-import string
 from datetime import datetime, timedelta
 from typing import Optional, List
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import Movie, User, Rating, Stats
+from catalog import code_allocator, movie_catalog
+from leaderboard import movie_leaderboard, user_leaderboard, ensure_exact
+from rollups import get_rollup, day_start, ROLLUP_WINDOWS
+from counters import activity_tracker
 
 
 class CodeGenerator:
@@ -14,17 +16,13 @@ class CodeGenerator:
     @staticmethod
     async def generate_unique_code(db: AsyncSession, length: int = 4) -> str:
         """Generate unique numeric code"""
-        max_attempts = 100
+        if length != code_allocator.code_length:
+            raise ValueError(f"Only {code_allocator.code_length}-digit codes are supported")
         
-        for _ in range(max_attempts):
-            code = ''.join(random.choices(string.digits, k=length))
-            
-            # Check if code exists
-            result = await db.execute(select(Movie).where(Movie.code == code))
-            if not result.scalar_one_or_none():
-                return code
+        if not code_allocator.loaded:
+            await code_allocator.load(db)
         
-        raise ValueError("Could not generate unique code after maximum attempts")
+        return code_allocator.allocate()
     
     @staticmethod
     async def validate_code(code: str) -> bool:
@@ -74,76 +72,82 @@ class StatsCalculator:
     
     @staticmethod
     async def get_period_stats(db: AsyncSession, days: int = 1) -> dict:
-        """Get statistics for specific period"""
-        period_start = datetime.utcnow() - timedelta(days=days)
+        """Get statistics for specific period (from rollups)"""
+        stats_type = {window: name for name, window in ROLLUP_WINDOWS.items()}.get(days)
         
-        # New users
-        new_users_result = await db.execute(
-            select(func.count(User.id)).where(User.joined_at >= period_start)
-        )
-        new_users = new_users_result.scalar()
+        if stats_type:
+            stats = await get_rollup(db, stats_type)
+            if stats:
+                return {
+                    'new_users': stats.new_users,
+                    'new_movies': stats.new_movies,
+                    'active_users': stats.active_users,
+                    'period_days': days
+                }
+        
+        # Other periods: sum daily rollups
+        period_start = day_start(datetime.utcnow()) - timedelta(days=days - 1)
         
-        # New movies
-        new_movies_result = await db.execute(
-            select(func.count(Movie.id)).where(Movie.created_at >= period_start)
+        result = await db.execute(
+            select(func.sum(Stats.new_users), func.sum(Stats.new_movies)).where(
+                Stats.stats_type == "daily",
+                Stats.date >= period_start
+            )
         )
-        new_movies = new_movies_result.scalar()
+        new_users, new_movies = result.one()
         
-        # Active users
+        # last_active is written in batches, store pending first
+        await activity_tracker.flush()
         active_users_result = await db.execute(
             select(func.count(User.id)).where(User.last_active >= period_start)
         )
         active_users = active_users_result.scalar()
         
         return {
-            'new_users': new_users,
-            'new_movies': new_movies,
+            'new_users': new_users or 0,
+            'new_movies': new_movies or 0,
             'active_users': active_users,
             'period_days': days
         }
     
     @staticmethod
     async def get_top_movies(db: AsyncSession, limit: int = 10) -> List[dict]:
-        """Get top movies by views"""
-        result = await db.execute(
-            select(Movie)
-            .where(Movie.is_active == True)
-            .order_by(Movie.views.desc())
-            .limit(limit)
-        )
-        movies = result.scalars().all()
+        """Get top movies by views (from leaderboard)"""
+        await ensure_exact()
         
-        return [
-            {
+        top = []
+        for movie_id, views in movie_leaderboard.top(limit):
+            movie = movie_catalog.get_by_id(movie_id)
+            if not movie:
+                continue
+            top.append({
                 'id': movie.id,
                 'code': movie.code,
                 'title': movie.title,
-                'views': movie.views,
+                'views': views,
                 'likes': movie.likes,
                 'dislikes': movie.dislikes
-            }
-            for movie in movies
-        ]
+            })
+        return top
     
     @staticmethod
     async def get_top_users(db: AsyncSession, limit: int = 10) -> List[dict]:
-        """Get most active users"""
-        result = await db.execute(
-            select(User)
-            .where(User.is_blocked == False)
-            .order_by(User.watched_movies.desc())
-            .limit(limit)
-        )
-        users = result.scalars().all()
+        """Get most active users (from leaderboard)"""
+        await ensure_exact()
+        leaders = user_leaderboard.top(limit)
+        
+        result = await db.execute(select(User).where(User.id.in_([user_id for user_id, _ in leaders])))
+        users = {user.id: user for user in result.scalars().all()}
         
         return [
             {
-                'id': user.id,
-                'name': user.first_name,
-                'watched_movies': user.watched_movies,
-                'total_ratings': user.total_ratings
+                'id': user_id,
+                'name': users[user_id].first_name,
+                'watched_movies': watched,
+                'total_ratings': users[user_id].total_ratings
             }
-            for user in users
+            for user_id, watched in leaders
+            if user_id in users
         ]
 
 
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import signal
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandler(SimpleRequestHandler):
+    """Answers Telegram at once, updates are processed in background tasks
+
+    Requests without the right X-Telegram-Bot-Api-Secret-Token get 401.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, drain_timeout: float = 30):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, secret_token=secret_token)
+        self.drain_timeout = drain_timeout
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self, app: web.Application):
+        """Wait for updates still being processed (before shutdown hooks)"""
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+
+        logger.info(f"Waiting for {len(tasks)} updates in progress...")
+        done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+
+
+def stop_event() -> asyncio.Event:
+    """Event set on SIGINT / SIGTERM"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C still cancels the loop
+            pass
+    return stop
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    app = web.Application()
+    handler = WebhookHandler(dispatcher=dp, bot=bot, secret_token=Config.WEBHOOK_SECRET)
+
+    # Shutdown order: in-flight updates -> dispatcher shutdown -> bot session
+    app.on_shutdown.append(handler.drain)
+    setup_application(app, dp, bot=bot)
+    handler.register(app, path=Config.WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Serve updates over HTTP until SIGINT / SIGTERM"""
+    await serve(create_app(bot, dp), bot, dp.resolve_used_update_types())
+
+
+async def serve(app: web.Application, bot: Bot, allowed_updates: List[str], stop: Optional[asyncio.Event] = None):
+    """Run webhook app, register it with Telegram and wait for a stop signal"""
+    runner = web.AppRunner(app)
+    await runner.setup()  # runs app startup hooks
+    stop = stop or stop_event()
+
+    try:
+        site = web.TCPSite(runner, Config.WEBAPP_HOST, Config.WEBAPP_PORT)
+        await site.start()
+        logger.info(f"🌐 Webhook server on {Config.WEBAPP_HOST}:{Config.WEBAPP_PORT}{Config.WEBHOOK_PATH}")
+
+        # Register only once the server accepts requests
+        if Config.WEBHOOK_URL:
+            await bot.set_webhook(
+                url=Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=True
+            )
+            logger.info("✅ Webhook registered")
+        else:
+            logger.warning("WEBHOOK_URL is not set, webhook not registered")
+
+        await stop.wait()
+    finally:
+        await runner.cleanup()  # runs app shutdown hooks
@@ -0,0 +1,344 @@
+import asyncio
+import logging
+import multiprocessing
+import secrets
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot
+from sqlalchemy import select
+
+from database import init_db, close_db, read_session_maker, User
+from cache import user_cache
+from catalog import movie_catalog
+from counters import PeriodicFlusher, view_counter
+from leaderboard import seed_movie_leaderboard
+from webhook import serve, stop_event, health
+from log_pipeline import setup_logging, stop_logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Sender of a raw update, 0 if it has none"""
+    for key, value in update.items():
+        if key != "update_id" and isinstance(value, dict):
+            return (value.get("from") or {}).get("id", 0)
+    return 0
+
+
+class ControlChannel:
+    """Cache invalidations shared by worker processes
+
+    A worker puts (kind, value) on the control queue and the receiver copies
+    it to every worker queue. In a single process only local caches are
+    touched.
+    """
+
+    def __init__(self):
+        self.queue: Optional[multiprocessing.Queue] = None
+
+    def publish(self, kind: str, value: Any = None):
+        if self.queue is not None:
+            self.queue.put((kind, value))
+
+
+cluster = ControlChannel()
+
+
+def invalidate_user(tg_id: int):
+    """Drop cached user row in this and every other worker"""
+    user_cache.invalidate(tg_id)
+    cluster.publish("user", tg_id)
+
+
+def catalog_changed():
+    """Other workers reload the movie catalog now instead of on their timer"""
+    cluster.publish("catalog")
+
+
+async def apply_control(kind: str, value: Any):
+    if kind == "user":
+        user_cache.invalidate(value)
+    elif kind == "catalog":
+        await catalog_refresher.flush()
+
+
+class AdminDirectory(PeriodicFlusher):
+    """Admin ids (.env and DB) known to the receiver, reloaded on a timer"""
+
+    def __init__(self, flush_interval: float):
+        super().__init__(flush_interval)
+        self.ids = set(Config.ADMIN_IDS)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.ids
+
+    async def flush(self):
+        try:
+            async with read_session_maker() as session:
+                result = await session.execute(select(User.tg_id).where(User.is_admin == True))
+                self.ids = set(Config.ADMIN_IDS) | set(result.scalars())
+        except Exception as e:
+            logger.error(f"Admin list reload failed: {e}")
+
+
+class UpdateRouter:
+    """Puts raw updates on worker queues, partitioned by sender
+
+    One user always lands on the same worker, admins (same rule as
+    is_admin: .env or DB flag) on the primary one, which owns the code
+    allocator, broadcasts and shared jobs.
+    """
+
+    def __init__(self, queues: List[multiprocessing.Queue], shards: int, primary: int, admins: AdminDirectory):
+        self.queues = queues
+        self.shards = shards
+        self.primary = primary
+        self.admins = admins
+        self.routed = [0] * len(queues)
+
+    def worker_for(self, update: Dict[str, Any]) -> int:
+        user_id = update_user_id(update)
+        if user_id in self.admins:
+            return self.primary
+        return user_id % self.shards
+
+    def dispatch(self, update: Dict[str, Any]):
+        index = self.worker_for(update)
+        self.queues[index].put(update)
+        self.routed[index] += 1
+
+    def broadcast(self, message: Tuple[str, Any]):
+        """Control message for every worker"""
+        for queue in self.queues:
+            queue.put(message)
+
+    def close(self):
+        """Workers finish queued updates and stop"""
+        for queue in self.queues:
+            queue.put(None)
+
+
+class OrderedByUser:
+    """Runs one user's updates one after another, different users concurrently"""
+
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, user_id: int, handler: Awaitable):
+        previous = self._tails.get(user_id)
+        task = asyncio.create_task(self._run(previous, handler))
+        self._tails[user_id] = task
+
+        def _done(finished: asyncio.Task):
+            if self._tails.get(user_id) is finished:
+                del self._tails[user_id]
+
+        task.add_done_callback(_done)
+
+    @staticmethod
+    async def _run(previous, handler: Awaitable):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await handler
+        except Exception as e:
+            logger.exception(f"Update failed: {e}")
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+class CatalogRefresher(PeriodicFlusher):
+    """Reloads the movie catalog in every worker process"""
+
+    async def flush(self):
+        try:
+            # Views counted here reach the DB first, so reloaded counters include them
+            await view_counter.flush()
+            async with read_session_maker() as session:
+                await movie_catalog.load(session)
+            seed_movie_leaderboard()
+        except Exception as e:
+            logger.error(f"Catalog refresh failed: {e}")
+
+
+catalog_refresher = CatalogRefresher(flush_interval=Config.CATALOG_REFRESH_INTERVAL)
+
+
+def worker_main(index: int, queue: multiprocessing.Queue, control: multiprocessing.Queue, primary: bool):
+    """Worker process entry point"""
+    # Ctrl+C reaches the whole group, the receiver stops workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    cluster.queue = control
+    # Own file per process: rotation never races between processes
+    setup_logging(f"logs/worker-{index}.log")
+    try:
+        asyncio.run(run_worker(index, queue, primary))
+    finally:
+        stop_logging()
+
+
+async def run_worker(index: int, queue: multiprocessing.Queue, primary: bool):
+    from bot import create_bot, create_dispatcher
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    dp["primary"] = primary
+    dp["sharded"] = True
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    logger.info(f"👷 Worker {index} ready{' (primary)' if primary else ''}")
+
+    ordered = OrderedByUser()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            update = await loop.run_in_executor(None, queue.get)
+            if update is None:
+                break
+            if isinstance(update, tuple):
+                await apply_control(*update)
+                continue
+            ordered.submit(update_user_id(update), dp.feed_raw_update(bot, update))
+        await ordered.join()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+
+
+async def poll_updates(bot: Bot, router: UpdateRouter, allowed_updates: List[str]):
+    """Long polling that only hands updates over"""
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    failures = 0
+
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            failures += 1
+            logger.error(f"getUpdates failed: {e}")
+            await asyncio.sleep(min(2 ** failures, 30))
+            continue
+
+        failures = 0
+        for update in updates:
+            router.dispatch(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+            offset = update.update_id + 1
+
+
+def create_receiver_app(router: UpdateRouter) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, Config.WEBHOOK_SECRET):
+            return web.Response(body="Unauthorized", status=401)
+
+        router.dispatch(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(Config.WEBHOOK_PATH, handle)
+    app.router.add_get("/health", health)
+    return app
+
+
+async def relay_control(control: multiprocessing.Queue, router: UpdateRouter):
+    """Copy control messages from workers to all workers"""
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await loop.run_in_executor(None, control.get)
+        if message is None:
+            break
+        router.broadcast(message)
+
+
+async def watch_workers(processes: List[multiprocessing.Process], start: Callable[..., multiprocessing.Process], stop: asyncio.Event):
+    """Restart crashed workers, stop all if one keeps crashing"""
+    restarts = [0] * len(processes)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            return
+
+        for index, process in enumerate(processes):
+            if process.exitcode is None:
+                continue
+            if restarts[index] >= Config.WORKER_MAX_RESTARTS:
+                logger.critical(f"Worker {index} keeps exiting ({process.exitcode}), stopping")
+                stop.set()
+                return
+            restarts[index] += 1
+            logger.error(
+                f"Worker {index} exited with {process.exitcode}, "
+                f"restarting ({restarts[index]}/{Config.WORKER_MAX_RESTARTS})"
+            )
+            processes[index] = start(index, fresh=True)
+
+
+async def run_sharded(bot: Bot, allowed_updates: List[str]):
+    """Receive updates here and handle them in worker processes
+
+    WORKERS processes are shards by user id; with ADMIN_WORKER an extra
+    process serves admins and broadcasts, otherwise worker 0 does.
+    """
+    # Schema is created once, before workers start
+    await init_db()
+    admins = AdminDirectory(flush_interval=Config.CATALOG_REFRESH_INTERVAL)
+    await admins.flush()
+
+    shards = Config.WORKERS
+    total = shards + 1 if Config.ADMIN_WORKER else shards
+    primary = total - 1 if Config.ADMIN_WORKER else 0
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(total)]
+    control = context.Queue()
+
+    def start(index: int, fresh: bool = False) -> multiprocessing.Process:
+        if fresh:
+            # A killed worker may hold the queue's read lock: updates still
+            # queued for it are lost, the router switches to the new queue
+            queues[index] = context.Queue()
+        process = context.Process(
+            target=worker_main,
+            args=(index, queues[index], control, index == primary),
+            name=f"worker-{index}"
+        )
+        process.start()
+        return process
+
+    processes = [start(index) for index in range(total)]
+
+    router = UpdateRouter(queues, shards, primary, admins)
+    relay = asyncio.create_task(relay_control(control, router))
+    admins.start()
+    loop = asyncio.get_running_loop()
+    stop = stop_event()
+    watcher = asyncio.create_task(watch_workers(processes, start, stop))
+    logger.info(f"🚀 Receiving updates ({Config.UPDATE_MODE}) for {total} workers...")
+
+    try:
+        if Config.UPDATE_MODE == "webhook":
+            await serve(create_receiver_app(router), bot, allowed_updates, stop)
+        else:
+            polling = asyncio.create_task(poll_updates(bot, router, allowed_updates))
+            await stop.wait()
+            polling.cancel()
+    finally:
+        stop.set()
+        await watcher
+        router.close()
+        for process in processes:
+            await loop.run_in_executor(None, process.join)
+        control.put(None)
+        await relay
+        await admins.stop()
+        await close_db()
+        logger.info(f"📦 Updates per worker: {router.routed}")
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session_maker, begin_write
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# async def operation(session) -> result
+WriteOperation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class WriteQueue:
+    """Single writer task applying queued operations with group commit
+
+    Operations waiting in the queue are run in one transaction, each in its
+    own SAVEPOINT so a failing operation is rolled back alone. submit()
+    returns after the commit (durable), submit_nowait() does not wait.
+    """
+
+    def __init__(self, max_batch: int = 200, max_delay: float = 0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[Optional[Tuple[WriteOperation, Optional[asyncio.Future]]]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._direct_tasks: Set[asyncio.Task] = set()
+        self.operations = 0
+        self.commits = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def submit(self, operation: WriteOperation) -> Any:
+        """Queue operation and wait until it is committed, returns its result"""
+        if not self.running:
+            # Writer not started (startup / scripts): own transaction
+            return await self._apply_direct(operation)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    def submit_nowait(self, operation: WriteOperation):
+        """Queue operation without waiting (errors are only logged)"""
+        if not self.running:
+            task = asyncio.create_task(self._apply_direct(operation, log_errors=True))
+            self._direct_tasks.add(task)
+            task.add_done_callback(self._direct_tasks.discard)
+            return
+
+        self._queue.put_nowait((operation, None))
+
+    async def _apply_direct(self, operation: WriteOperation, log_errors: bool = False) -> Any:
+        try:
+            async with async_session_maker() as session:
+                await begin_write(session)
+                result = await operation(session)
+                await session.commit()
+                return result
+        except Exception as e:
+            if not log_errors:
+                raise
+            logger.error(f"Write failed: {e}")
+
+    async def _apply(self, batch: List[Tuple[WriteOperation, Optional[asyncio.Future]]]):
+        outcomes = []
+
+        try:
+            async with async_session_maker() as session:
+                await begin_write(session)
+                for operation, future in batch:
+                    try:
+                        async with session.begin_nested():
+                            outcomes.append((future, await operation(session), None))
+                    except Exception as e:
+                        outcomes.append((future, None, e))
+                await session.commit()
+        except Exception as e:
+            # Whole group lost
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            self.failed += len(batch)
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.operations += len(batch)
+
+        for future, result, error in outcomes:
+            if error is not None:
+                self.failed += 1
+                if future is None:
+                    logger.error(f"Write failed: {error}")
+            if future is None or future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def _run(self):
+        stopping = False
+
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            # Let concurrent handlers join this commit
+            if self.max_delay:
+                await asyncio.sleep(self.max_delay)
+
+            batch = [item]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._apply(batch)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Apply everything queued, then stop the writer"""
+        task, self._task = self._task, None
+        if task is not None:
+            # Writes submitted from now on run directly
+            self._queue.put_nowait(None)
+            await task
+        if self._direct_tasks:
+            await asyncio.gather(*self._direct_tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queue.qsize(),
+            'operations': self.operations,
+            'commits': self.commits,
+            'failed': self.failed,
+            'per_commit': round(self.operations / self.commits, 1) if self.commits else 0.0
+        }
+
+
+write_queue = WriteQueue(
+    max_batch=Config.WRITE_QUEUE_MAX_BATCH,
+    max_delay=Config.WRITE_QUEUE_MAX_DELAY
+)